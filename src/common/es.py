@@ -0,0 +1,65 @@
+import logging
+import os
+
+from elasticsearch import Elasticsearch, helpers
+
+
+def getClient(uri):
+    """ Get an Elasticsearch client for <uri>, using basic auth from the environment if set. """
+    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
+    return Elasticsearch([uri], basic_auth=auth if all(auth) else None)
+
+
+def bulkIndex(loggerName, database, entries, idKey=None):
+    """
+    Index a list of entries into the ES database, <database>, with a single bulk request.
+
+    Parameters:
+    -----------
+    loggerName : str
+        Logger name
+    database : dict
+        Output database definition from the tasks file (requires "uri" and "index").
+    entries : list of dict
+        Documents to index.
+    idKey : str, optional
+        Key in each entry to use as the document id (default is to let ES assign one).
+
+    Returns:
+    --------
+    int
+        The number of documents successfully indexed.
+    """
+    logger = logging.getLogger(loggerName)
+    if not entries:
+        logger.debug("No entries to send to ES database.")
+        return 0
+
+    def bulkDataGenerator():
+        for entry in entries:
+            action = {
+                "_index": database["index"],
+                "_op_type": "index",
+                "_source": entry
+            }
+            if idKey is not None:
+                action["_id"] = entry[idKey]
+            yield action
+
+    es = getClient(database["uri"])
+    nIndexed, errors = helpers.bulk(es, bulkDataGenerator(), chunk_size=len(entries), raise_on_error=False)
+    if errors:
+        logger.warning("Failed to index {} of {} entries".format(len(errors), len(entries)))
+        logger.debug(repr(errors))
+    return nIndexed
+
+
+def pushToDatabases(loggerName, databases, entries, idKey=None):
+    """ Send <entries> to each ES database in <databases> with one bulk request per database. """
+    logger = logging.getLogger(loggerName)
+    if databases is None:
+        return
+    for database in databases:
+        if database["type"] == "es":
+            logger.info("Sending {} entries to ES database...".format(len(entries)))
+            bulkIndex(loggerName, database, entries, idKey=idKey)
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+from astropy.io import fits
+
+# Number of float64 elements generated and written per chunk (8 MiB).
+#
+DEFAULT_CHUNK_SIZE = 2 ** 20
+
+# Structural keywords that are derived from the data shape and cannot be overridden by a user header.
+#
+RESERVED_KEYWORDS = ('SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'PCOUNT', 'GCOUNT', 'EXTEND', 'END')
+
+
+def _isReservedKeyword(key):
+    key = key.upper()
+    return key in RESERVED_KEYWORDS or (key.startswith('NAXIS') and key[5:].isdigit())
+
+
+def generateRandomFITSFile(path, shape, header=None, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Generate a FITS file at <path> with an image extension of float64 random data of dimensions, <shape>.
+
+    The header is written first and the data section is then streamed in chunks of <chunkSize> elements so that peak
+    memory is bounded by the chunk size rather than the dimensions of the image. Cards in <header> are added to the
+    image header, except for structural keywords which are derived from <shape>. Any existing file at <path> is
+    overwritten.
+
+    Returns the path to the file.
+    """
+    if isinstance(shape, int):
+        shape = (shape,)
+
+    # Build an image extension header. FITS axes are ordered fastest varying first, i.e. the reverse of a C-ordered
+    # numpy array.
+    #
+    hdr = fits.Header()
+    hdr['XTENSION'] = 'IMAGE'
+    hdr['BITPIX'] = -64
+    hdr['NAXIS'] = len(shape)
+    for idx, length in enumerate(reversed(shape), start=1):
+        hdr['NAXIS{}'.format(idx)] = int(length)
+    hdr['PCOUNT'] = 0
+    hdr['GCOUNT'] = 1
+    for key, value in (header or {}).items():
+        if not _isReservedKeyword(key):
+            hdr[key] = value
+
+    # StreamingHDU appends to existing files, so make sure we start from scratch.
+    #
+    if os.path.exists(path):
+        os.remove(path)
+
+    nElements = int(np.prod(shape))
+    rng = np.random.default_rng()
+    buffer = np.empty(min(chunkSize, nElements), dtype=np.float64)
+
+    shdu = fits.StreamingHDU(path, hdr)
+    try:
+        remaining = nElements
+        while remaining > 0:
+            chunk = buffer[:min(remaining, buffer.size)]
+            rng.random(out=chunk)
+            shdu.write(chunk)
+            remaining -= chunk.size
+    finally:
+        shdu.close()
+    return path
@@ -0,0 +1,109 @@
+import itertools
+import random
+from threading import Thread
+import time
+
+
+class LoadGenerator():
+    """
+    Write files to an ingestion staging area following an arrival process for a fixed duration.
+
+    Supported arrival processes are:
+    - constant: files arrive every 1/<rateHz> seconds,
+    - poisson: exponentially distributed inter-arrival times with mean 1/<rateHz> seconds,
+    - bursts: <burstSize> files arrive together every <burstSize>/<rateHz> seconds.
+
+    Files are written on a separate thread so that polling can run concurrently. The schedule is open-loop: if
+    writing falls behind, files are written as fast as possible until it catches up.
+    """
+
+    PROCESSES = ('constant', 'poisson', 'bursts')
+
+    def __init__(self, logger, writer, sizes, prefix, process="constant", rateHz=1, durationS=60, burstSize=10,
+                 onWritten=None):
+        """
+        :param logger: The logger instance to be used for logging.
+        :param writer: A StagingWriter.
+        :param sizes: A list of file sizes (bytes), cycled through for successive files.
+        :param prefix: The file name prefix.
+        :param process: The arrival process, one of constant || poisson || bursts.
+        :param rateHz: The mean arrival rate in files per second.
+        :param durationS: How long to generate files for in seconds.
+        :param burstSize: The number of files per burst (bursts only).
+        :param onWritten: A function called with the file name, write completion time and size for each file.
+        """
+        if process not in self.PROCESSES:
+            raise ValueError("Unknown arrival process {}, expected one of {}".format(
+                process, " || ".join(self.PROCESSES)))
+        self.logger = logger
+        self.writer = writer
+        self.sizes = sizes
+        self.prefix = prefix
+        self.process = process
+        self.rateHz = rateHz
+        self.durationS = durationS
+        self.burstSize = burstSize
+        self.onWritten = onWritten
+
+        self.nFilesWritten = 0
+        self.bytesWritten = 0
+        self.startedAt = None
+        self.finishedAt = None
+        self._thread = None
+
+    def arrivals(self):
+        """ Yield arrival times, in seconds from the start, up to <durationS>. """
+        if self.process == "constant":
+            offsets = (idx / self.rateHz for idx in itertools.count())
+        elif self.process == "poisson":
+            offsets = itertools.accumulate(random.expovariate(self.rateHz) for _ in itertools.count())
+        else:
+            offsets = ((idx // self.burstSize) * self.burstSize / self.rateHz for idx in itertools.count())
+        for offset in offsets:
+            if offset >= self.durationS:
+                return
+            yield offset
+
+    def _generate(self):
+        self.startedAt = time.time()
+        sizes = itertools.cycle(self.sizes)
+        for idx, offset in enumerate(self.arrivals()):
+            delay = self.startedAt + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            size = next(sizes)
+            try:
+                file_name, written_at = self.writer.write(size, "{}_{}".format(self.prefix, idx))
+            except Exception as e:
+                self.logger.critical("Error writing file to staging area: {}".format(repr(e)))
+                continue
+            self.nFilesWritten += 1
+            self.bytesWritten += size
+            if self.onWritten is not None:
+                self.onWritten(file_name, written_at, size)
+        self.finishedAt = time.time()
+        self.logger.info("Finished generating load: wrote {} files ({} bytes) in {}s".format(
+            self.nFilesWritten, self.bytesWritten, round(self.finishedAt - self.startedAt, 1)))
+
+    def start(self):
+        """ Begin writing files on a separate thread. """
+        self.logger.info("Generating {} load at {} files/s for {}s...".format(
+            self.process, self.rateHz, self.durationS))
+        self._thread = Thread(target=self._generate, daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def summary(self):
+        """ Summarise the generated load, averaging throughput over the full duration (or longer if writing lagged). """
+        elapsed = max((self.finishedAt or time.time()) - self.startedAt, self.durationS) if self.startedAt else 0
+        return {
+            "load_process": self.process,
+            "load_target_rate_hz": self.rateHz,
+            "load_duration_s": self.durationS,
+            "n_files_written": self.nFilesWritten,
+            "bytes_written": self.bytesWritten,
+            "write_throughput_files_per_s": self.nFilesWritten / elapsed if elapsed else None,
+            "write_throughput_bytes_per_s": self.bytesWritten / elapsed if elapsed else None,
+        }
@@ -0,0 +1,113 @@
+import re
+import subprocess
+from threading import Event, Thread
+import time
+
+
+class IngestServiceController():
+    """
+    Manage the lifecycle of a local srcnet-tools-ingest process.
+
+    The process' stdout and stderr are forwarded line by line to the logger on background threads. The service is
+    considered ready once a line matching <readyPattern> is seen or, if no pattern is given, once it produces any
+    output. If it is still running but has not signalled readiness after <readyTimeoutS>, it is assumed to be ready.
+    """
+
+    def __init__(self, logger, metadataSchemaPath, metadataSuffix, ingestionBackendName, frequency, batchSize,
+                 nProcesses=1, rucioIngestRseName=None, rucioPfnBasepath=None, readyPattern=None, readyTimeoutS=30,
+                 stopTimeoutS=10):
+        self.logger = logger
+        self.metadataSchemaPath = metadataSchemaPath
+        self.metadataSuffix = metadataSuffix
+        self.ingestionBackendName = ingestionBackendName
+        self.frequency = frequency
+        self.batchSize = batchSize
+        self.nProcesses = nProcesses
+        self.rucioIngestRseName = rucioIngestRseName
+        self.rucioPfnBasepath = rucioPfnBasepath
+        self.readyPattern = re.compile(readyPattern) if readyPattern else None
+        self.readyTimeoutS = readyTimeoutS
+        self.stopTimeoutS = stopTimeoutS
+
+        self.process = None
+        self._ready = Event()
+        self._pumps = []
+
+    @property
+    def command(self):
+        cmd = ['srcnet-tools-ingest',
+               '--frequency', str(self.frequency),
+               '--batch-size', str(self.batchSize),
+               '--metadata-schema-path', self.metadataSchemaPath,
+               '--metadata-suffix', self.metadataSuffix,
+               '--n-processes', str(self.nProcesses),
+               '--ingestion-backend-name', self.ingestionBackendName,
+               '--rucio-ingest-rse-name', self.rucioIngestRseName]
+        if self.rucioPfnBasepath:
+            cmd = cmd + ['--rucio-pfn-basepath', self.rucioPfnBasepath]
+        return cmd
+
+    def _pump(self, stream, name):
+        """ Forward lines from <stream> to the logger until it is closed. """
+        for line in iter(stream.readline, ''):
+            line = line.rstrip()
+            if not line:
+                continue
+            self.logger.info("[ingest {}] {}".format(name, line))
+            if self.readyPattern is None or self.readyPattern.search(line):
+                self._ready.set()
+        stream.close()
+
+    def start(self):
+        """ Start the service as a child process so that it doesn't block the main thread. """
+        self.logger.info("Starting ingestion service: {}".format(" ".join(self.command)))
+        self._ready.clear()
+        self.process = subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+        self._pumps = [
+            Thread(target=self._pump, args=(self.process.stdout, "stdout"), daemon=True),
+            Thread(target=self._pump, args=(self.process.stderr, "stderr"), daemon=True)
+        ]
+        for pump in self._pumps:
+            pump.start()
+
+    def waitUntilReady(self):
+        """ Block until the service is ready. Returns False if the service exited before becoming ready. """
+        deadline = time.time() + self.readyTimeoutS
+        while time.time() < deadline:
+            if self._ready.wait(timeout=0.5):
+                self.logger.info("Ingestion service is ready")
+                return True
+            if self.process.poll() is not None:
+                self.logger.critical("Ingestion service exited with code {} before becoming ready".format(
+                    self.process.returncode))
+                return False
+        if self.process.poll() is not None:
+            self.logger.critical("Ingestion service exited with code {}".format(self.process.returncode))
+            return False
+        self.logger.warning("Ingestion service did not signal readiness after {}s, continuing".format(
+            self.readyTimeoutS))
+        return True
+
+    def stop(self):
+        """ Terminate the service, killing it if it does not exit within <stopTimeoutS>. """
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.logger.info("Stopping ingestion service...")
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=self.stopTimeoutS)
+        except subprocess.TimeoutExpired:
+            self.logger.warning("Ingestion service did not terminate after {}s, killing".format(self.stopTimeoutS))
+            self.process.kill()
+            self.process.wait()
+        for pump in self._pumps:
+            pump.join(timeout=self.stopTimeoutS)
+        self.logger.info("Ingestion service exited with code {}".format(self.process.returncode))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
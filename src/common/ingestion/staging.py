@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import time
+
+from utility import generateRandomFile
+
+
+class StagingWriter():
+    """
+    Write randomly generated files, and their companion metadata files, to an ingestion staging area.
+
+    Files are written to a temporary directory, <tmpDir>, which must be on the same filesystem as the staging area but
+    outside the tree watched by the ingestion service. Once both files are complete, the metadata file and then the data
+    file are moved into the staging area with os.rename, so the service never sees a partially written file or a data
+    file without its metadata.
+    """
+
+    def __init__(self, logger, stagingDir, scope, lifetime, metadata, tmpDir, metaSuffix="meta", nThreads=4):
+        """
+        :param logger: The logger instance to be used for logging.
+        :param stagingDir: The directory to write files to.
+        :param scope: The Rucio scope files will be ingested to.
+        :param lifetime: The lifetime of the files in Rucio.
+        :param metadata: A function taking a file name and returning the metadata to set for it.
+        :param tmpDir: The directory to write files to before they are moved into <stagingDir>.
+        :param metaSuffix: The metadata file suffix.
+        :param nThreads: The number of threads to use when writing a batch of files.
+        """
+        self.logger = logger
+        self.stagingDir = stagingDir
+        self.scope = scope
+        self.lifetime = lifetime
+        self.metadata = metadata
+        self.metaSuffix = metaSuffix
+        self.tmpDir = tmpDir
+        self.nThreads = nThreads
+
+        os.makedirs(self.stagingDir, exist_ok=True)
+        os.makedirs(self.tmpDir, exist_ok=True)
+        if os.stat(self.stagingDir).st_dev != os.stat(self.tmpDir).st_dev:
+            raise ValueError("Temporary directory {} is not on the same filesystem as staging directory {}".format(
+                self.tmpDir, self.stagingDir))
+
+    def _writeTmp(self, size, prefix):
+        """ Write a file and its metadata file to the temporary directory, returning the file name. """
+        file = generateRandomFile(size, prefix=prefix, dirname=self.tmpDir)
+
+        file_name = os.path.basename(file.name)
+        meta_dict = {
+            "name": file_name,
+            "namespace": self.scope,
+            "lifetime": self.lifetime,
+            "meta": self.metadata(file_name)
+        }
+        with open(os.path.join(self.tmpDir, "{}.{}".format(file_name, self.metaSuffix)), 'w') as meta_file:
+            json.dump(meta_dict, meta_file, indent=2)
+        return file_name
+
+    def _publish(self, file_name):
+        """ Move a file written by _writeTmp into the staging area, metadata first. """
+        meta_name = "{}.{}".format(file_name, self.metaSuffix)
+        os.rename(os.path.join(self.tmpDir, meta_name), os.path.join(self.stagingDir, meta_name))
+        os.rename(os.path.join(self.tmpDir, file_name), os.path.join(self.stagingDir, file_name))
+        return time.time()
+
+    def write(self, size, prefix):
+        """
+        Write a file of size <size> with name prefix, <prefix>, and its metadata file.
+
+        Returns the file name and the (epoch) time at which both files were moved into the staging area.
+        """
+        file_name = self._writeTmp(size, prefix)
+        return file_name, self._publish(file_name)
+
+    def writeBatch(self, sizes, prefixes):
+        """
+        Write a file for each of <sizes> and <prefixes> in parallel, then move them into the staging area in order.
+
+        Returns a list of (file name, time moved into the staging area) in the same order as <sizes>.
+        """
+        with ThreadPoolExecutor(max_workers=self.nThreads) as executor:
+            file_names = list(executor.map(self._writeTmp, sizes, prefixes))
+        return [(file_name, self._publish(file_name)) for file_name in file_names]
@@ -0,0 +1,84 @@
+import random
+import time
+
+
+class Poller():
+    """
+    Repeatedly call a function until a condition on its result is met or a deadline passes.
+
+    The interval between calls starts at <initialIntervalS> and is multiplied by <backoffFactor> after each call,
+    up to <maxIntervalS>. Each interval is randomly scaled by up to +/- <jitter> (a fraction) so that concurrent
+    pollers do not synchronise, and is truncated so that the deadline is never overshot.
+
+    The times (seconds since polling started) at which the result was first "seen" and at which the condition was
+    met are recorded so they can be reported.
+    """
+
+    def __init__(self, logger, initialIntervalS=1, maxIntervalS=60, backoffFactor=2, jitter=0.1, deadlineS=300):
+        """
+        :param logger: The logger instance to be used for logging.
+        :param initialIntervalS: The interval before the second call in seconds.
+        :param maxIntervalS: The maximum interval between calls in seconds.
+        :param backoffFactor: The factor the interval is multiplied by after each call.
+        :param jitter: The maximum fraction by which each interval is randomly scaled.
+        :param deadlineS: How long to poll for in seconds.
+        """
+        self.logger = logger
+        self.initialIntervalS = initialIntervalS
+        self.maxIntervalS = maxIntervalS
+        self.backoffFactor = backoffFactor
+        self.jitter = jitter
+        self.deadlineS = deadlineS
+
+        self.nPolls = 0
+        self.firstSeenS = None
+        self.conditionMetS = None
+
+    def poll(self, fetch, condition, seen=None, description="condition"):
+        """
+        Call <fetch> until <condition> is true of its result or the deadline passes.
+
+        :param fetch: A function taking no arguments. Exceptions are not caught.
+        :param condition: A function taking the result of <fetch> and returning True when polling can stop.
+        :param seen: A function taking the result of <fetch> and returning True when something has been seen
+            (default is when the condition is met).
+        :param description: A description of the condition used in log messages.
+
+        Returns a tuple of whether the condition was met and the last result of <fetch>.
+        """
+        self.nPolls = 0
+        self.firstSeenS = None
+        self.conditionMetS = None
+
+        startedAt = time.time()
+        deadline = startedAt + self.deadlineS
+        interval = self.initialIntervalS
+        while True:
+            result = fetch()
+            self.nPolls += 1
+            now = time.time()
+            if self.firstSeenS is None and seen is not None and seen(result):
+                self.firstSeenS = now - startedAt
+            if condition(result):
+                self.conditionMetS = now - startedAt
+                if self.firstSeenS is None:
+                    self.firstSeenS = self.conditionMetS
+                return True, result
+
+            remaining = deadline - now
+            if remaining <= 0:
+                self.logger.debug("Deadline of {}s reached after {} polls waiting for {}".format(
+                    self.deadlineS, self.nPolls, description))
+                return False, result
+            delay = min(interval * random.uniform(1 - self.jitter, 1 + self.jitter), remaining)
+            self.logger.info("Waiting for {}, next poll in {}s...".format(description, round(delay, 1)))
+            time.sleep(delay)
+            interval = min(interval * self.backoffFactor, self.maxIntervalS)
+
+    def timings(self, prefix=""):
+        """ Get the recorded timings for the last call to poll() as a dictionary with keys prefixed by <prefix>. """
+        return {
+            "{}n_polls".format(prefix): self.nPolls,
+            "{}first_seen_s".format(prefix): self.firstSeenS,
+            "{}condition_met_s".format(prefix): self.conditionMetS,
+        }
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+import datetime
+import json
+import re
+from threading import Lock
+
+# Rucio daemons: "<%Y-%m-%d %H:%M:%S,%f>\t<process>\t<pid>\t<level>\t<message>".
+_RUCIO_TAB = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})\t[^\t]*\t[^\t]*\t[^\t]*\t(.*)$")
+# Lines prefixed with an ISO 8601 timestamp, e.g. from Python's default logging format or the kubelet
+# (timestamps=True), which may have nanosecond precision.
+_ISO_PREFIX = re.compile(
+    r"^\[?(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})(?:[.,](\d+))?(Z|[+-]\d{2}:?\d{2})?\]?\s+(.*)$")
+# Apache access/error logs, e.g. from the Rucio server: "[15/Jan/2024:10:23:45 +0000]".
+_APACHE = re.compile(r"^.*?\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4})\]\s*(.*)$")
+
+JSON_TIME_KEYS = ('@timestamp', 'timestamp', 'time', 'asctime')
+JSON_MESSAGE_KEYS = ('message', 'msg')
+
+
+def _toUTC(dt):
+    """ Convert an aware datetime to naive UTC, assuming naive datetimes are already UTC. """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _parseRucioTab(line):
+    match = _RUCIO_TAB.match(line)
+    if match is None:
+        return None
+    return datetime.datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S,%f"), match.group(2).strip()
+
+
+def _parseISOPrefix(line):
+    match = _ISO_PREFIX.match(line)
+    if match is None:
+        return None
+    seconds, fraction, zone, message = match.groups()
+    # fromisoformat only accepts up to microsecond precision.
+    timestamp = seconds + ('.' + fraction[:6].ljust(6, '0') if fraction else '') + (zone or '')
+    return _toUTC(datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))), message.strip()
+
+
+def _parseJSON(line):
+    if not line.startswith('{'):
+        return None
+    record = json.loads(line)
+    timestamp = next((record[key] for key in JSON_TIME_KEYS if key in record), None)
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, bool):
+        return None
+    if isinstance(timestamp, (int, float)):
+        # Epoch seconds, or milliseconds if implausibly far in the future.
+        logDate = datetime.datetime.utcfromtimestamp(timestamp / 1000 if timestamp > 1e11 else timestamp)
+    else:
+        parsed = _parseISOPrefix("{} -".format(timestamp))
+        if parsed is None:
+            return None
+        logDate = parsed[0]
+    message = next((record[key] for key in JSON_MESSAGE_KEYS if key in record), line)
+    return logDate, str(message)
+
+
+def _parseApache(line):
+    match = _APACHE.match(line)
+    if match is None:
+        return None
+    return _toUTC(datetime.datetime.strptime(match.group(1), "%d/%b/%Y:%H:%M:%S %z")), match.group(2).strip()
+
+
+class DaemonLogParser():
+    """
+    Parse the time (as naive UTC) and message of daemon log lines.
+
+    Each known format is tried in turn using a precompiled pattern and strptime/fromisoformat. The format that last
+    worked for each daemon type is remembered in a bounded LRU cache and tried first, so the format is only
+    detected again if a daemon's output changes. Lines that don't match any format give (None, None).
+    """
+
+    FORMATS = OrderedDict([
+        ('rucio', _parseRucioTab),
+        ('json', _parseJSON),
+        ('iso', _parseISOPrefix),
+        ('apache', _parseApache),
+    ])
+
+    def __init__(self, maxTypes=256):
+        """
+        :param maxTypes: The maximum number of daemon types to remember formats for.
+        """
+        self.maxTypes = maxTypes
+        self._formats = OrderedDict()     # daemon type -> format name
+        self._lock = Lock()
+
+    def _tryFormat(self, name, line):
+        try:
+            return self.FORMATS[name](line)
+        except (ValueError, OverflowError, OSError):
+            # e.g. an out of range epoch time in a JSON line.
+            return None
+
+    def parse(self, daemonType, log):
+        """
+        Parse the last non-empty line of <log> from a daemon of type <daemonType>.
+
+        Returns a tuple of (time, message), or (None, None) if the line can't be parsed.
+        """
+        line = next((line.strip() for line in reversed(log.splitlines()) if line.strip()), None) if log else None
+        if line is None:
+            return None, None
+
+        with self._lock:
+            cached = self._formats.get(daemonType)
+            if cached is not None:
+                self._formats.move_to_end(daemonType)
+        if cached is not None:
+            parsed = self._tryFormat(cached, line)
+            if parsed is not None:
+                return parsed
+
+        for name in self.FORMATS:
+            if name == cached:
+                continue
+            parsed = self._tryFormat(name, line)
+            if parsed is not None:
+                with self._lock:
+                    self._formats[daemonType] = name
+                    self._formats.move_to_end(daemonType)
+                    while len(self._formats) > self.maxTypes:
+                        self._formats.popitem(last=False)
+                return parsed
+        return None, None
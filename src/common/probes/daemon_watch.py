@@ -0,0 +1,180 @@
+import datetime
+from threading import Event, Lock, Thread
+
+from kubernetes import watch
+
+
+class DaemonWatcher():
+    """
+    Maintain an in-memory table of daemon pod health from kubernetes watch streams.
+
+    One watch stream follows pod events in the namespace (phase changes, restarts, additions and deletions), and
+    another follows the log of each running daemon pod, starting from the last <logTailLines> lines. Each stream
+    runs on its own daemon thread and is restarted if it ends (e.g. when the server times out the watch) until
+    stop() is called.
+
+    The CoreV1Api, <v1>, and the watch factory, <watchFactory>, are passed in so that a fake API server can be
+    used instead of a real cluster.
+    """
+
+    def __init__(self, logger, v1, namespace, daemonLikeNames, parseLine, labelSelector=None, logTailLines=1,
+                 watchTimeoutS=300, watchFactory=watch.Watch):
+        """
+        :param logger: The logger instance to be used for logging.
+        :param v1: A kubernetes CoreV1Api.
+        :param namespace: The namespace to watch.
+        :param daemonLikeNames: Substrings of the names of pods to include, each identifying a daemon type.
+        :param parseLine: A function taking a daemon type and a log line and returning (time, message), with a None
+            time if the line can't be parsed.
+        :param labelSelector: A label selector to narrow the pods watched server-side.
+        :param logTailLines: The number of existing log lines to read when starting to follow a pod's log.
+        :param watchTimeoutS: The server-side timeout of each pod watch request.
+        :param watchFactory: A function returning a new kubernetes.watch.Watch (or equivalent).
+        """
+        self.logger = logger
+        self.v1 = v1
+        self.namespace = namespace
+        self.daemonLikeNames = daemonLikeNames
+        self.parseLine = parseLine
+        self.labelSelector = labelSelector
+        self.logTailLines = logTailLines
+        self.watchTimeoutS = watchTimeoutS
+        self.watchFactory = watchFactory
+
+        self.pods = {}          # pod name -> row
+        self._lock = Lock()
+        self._stop = Event()
+        self._watches = []
+        self._following = set()
+        self._threads = []
+
+    def _likeName(self, podName):
+        return next((likeName for likeName in self.daemonLikeNames if likeName in podName), None)
+
+    def _newWatch(self):
+        w = self.watchFactory()
+        with self._lock:
+            self._watches.append(w)
+        return w
+
+    def _releaseWatch(self, w):
+        """ Forget a watch once its stream has ended, so restarts don't accumulate watches. """
+        with self._lock:
+            self._watches.remove(w)
+
+    def _startThread(self, target, *args):
+        thread = Thread(target=target, args=args, daemon=True)
+        thread.start()
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            self._threads.append(thread)
+
+    def _updatePod(self, eventType, pod):
+        """ Update the table from a pod watch event, starting to follow the pod's log once it is running. """
+        podName = pod.metadata.name
+        likeName = self._likeName(podName)
+        if likeName is None:
+            return
+        if eventType == "DELETED":
+            with self._lock:
+                self.pods.pop(podName, None)
+            return
+
+        restarts = sum(status.restart_count for status in (pod.status.container_statuses or []))
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            row = self.pods.setdefault(podName, {
+                "pod_name": podName,
+                "daemon_like_name": likeName,
+                "pod_phase": None,
+                "pod_phase_since": now,
+                "pod_start_time": None,
+                "pod_restarts": 0,
+                "last_log_time_UTC": None,
+                "last_log_message": None,
+            })
+            if row["pod_phase"] != pod.status.phase:
+                row["pod_phase"] = pod.status.phase
+                row["pod_phase_since"] = now
+            row["pod_start_time"] = pod.status.start_time
+            row["pod_restarts"] = restarts
+            follow = pod.status.phase == "Running" and podName not in self._following
+            if follow:
+                self._following.add(podName)
+        if follow:
+            self._startThread(self._followLog, podName, likeName)
+
+    def _watchPods(self):
+        kwargs = {"namespace": self.namespace, "timeout_seconds": self.watchTimeoutS}
+        if self.labelSelector:
+            kwargs["label_selector"] = self.labelSelector
+        while not self._stop.is_set():
+            w = self._newWatch()
+            try:
+                for event in w.stream(self.v1.list_namespaced_pod, **kwargs):
+                    self._updatePod(event["type"], event["object"])
+                    if self._stop.is_set():
+                        break
+            except Exception as e:
+                self.logger.warning("Pod watch failed, restarting: {}".format(repr(e)))
+                self._stop.wait(1)
+            finally:
+                self._releaseWatch(w)
+
+    def _followLog(self, podName, likeName):
+        self.logger.debug("Following log for pod {}".format(podName))
+        w = self._newWatch()
+        try:
+            stream = w.stream(
+                self.v1.read_namespaced_pod_log, name=podName, namespace=self.namespace, follow=True,
+                tail_lines=self.logTailLines)
+            for line in stream:
+                logDate, logMessage = self.parseLine(likeName, line)
+                if logDate is not None:
+                    with self._lock:
+                        if podName in self.pods:
+                            self.pods[podName]["last_log_time_UTC"] = logDate
+                            self.pods[podName]["last_log_message"] = logMessage
+                if self._stop.is_set():
+                    break
+        except Exception as e:
+            self.logger.warning("Log stream for pod {} failed: {}".format(podName, repr(e)))
+        self._releaseWatch(w)
+        with self._lock:
+            # Allow the log to be followed again if the pod is (re)started.
+            self._following.discard(podName)
+
+    def start(self):
+        """ Start watching pods (and following logs of running daemon pods) on background threads. """
+        self._stop.clear()
+        self._startThread(self._watchPods)
+
+    def stop(self):
+        """ Stop all watch streams. """
+        self._stop.set()
+        with self._lock:
+            watches = list(self._watches)
+        for w in watches:
+            w.stop()
+
+    def snapshot(self, stallThresholdS=None):
+        """
+        Get a copy of the table as a list of rows, adding uptime and time since the last log message and, if
+        <stallThresholdS> is given, whether the daemon is stalled (running but silent for longer than this).
+        """
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            rows = [dict(row) for row in self.pods.values()]
+        for row in rows:
+            startTime = row["pod_start_time"]
+            logDate = row["last_log_time_UTC"]
+            row["pod_phase_bool"] = 1 if row["pod_phase"] == "Running" else 0
+            row["pod_uptime"] = (now - startTime.replace(tzinfo=None)).total_seconds() if startTime else None
+            row["seconds_since_last_message"] = (now - logDate).total_seconds() if logDate else None
+            if stallThresholdS is not None:
+                silentS = row["seconds_since_last_message"]
+                if silentS is None and startTime:
+                    silentS = row["pod_uptime"]
+                row["is_stalled"] = 1 if row["pod_phase"] == "Running" and silentS is not None \
+                    and silentS > stallThresholdS else 0
+        return rows
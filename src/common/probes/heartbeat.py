@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import aiohttp
+
+DEFAULT_CONNECT_TIMEOUT_S = 5
+DEFAULT_READ_TIMEOUT_S = 10
+DEFAULT_TOTAL_TIMEOUT_S = 30
+
+
+async def _probe(session, service, connectTimeoutS, readTimeoutS, totalTimeoutS, delayS=0, validator=None):
+    """
+    Make a GET request to a service's endpoint after <delayS>, recording the response and its latency.
+
+    If a <validator> is given, the body is also validated. Large bodies that the validator can stream are validated
+    as they are read, so their content is not kept, and the latency includes parsing up to the last checked value.
+
+    Any error is recorded in the result rather than raised, so that one failing endpoint doesn't affect the others.
+    """
+    if delayS > 0:
+        await asyncio.sleep(delayS)
+    # The total timeout bounds responses that keep trickling in within the read timeout.
+    timeout = aiohttp.ClientTimeout(
+        total=service.get("total_timeout_s", totalTimeoutS),
+        sock_connect=service.get("connect_timeout_s", connectTimeoutS),
+        sock_read=service.get("read_timeout_s", readTimeoutS)
+    )
+    result = {
+        "status_code": None,
+        "content": None,
+        "content_error": None,
+        "ttfb_s": None,
+        "latency_s": None,
+        "error": None
+    }
+    start = time.perf_counter()
+    try:
+        async with session.get(service["endpoint"], timeout=timeout) as response:
+            # The response is returned once the status line and headers have been read.
+            result["ttfb_s"] = time.perf_counter() - start
+            result["status_code"] = response.status
+            if validator is not None and validator.streams(response.content_length):
+                result["content_error"] = await validator.validateStream(response.content)
+            else:
+                result["content"] = await response.read()
+            result["latency_s"] = time.perf_counter() - start
+    except asyncio.TimeoutError:
+        result["error"] = "timeout after {}s".format(round(time.perf_counter() - start, 1))
+    except Exception as e:
+        result["error"] = repr(e)
+    if validator is not None and result["content"] is not None:
+        result["content_error"] = validator.validate(result["content"])
+    return result
+
+
+async def _probeAll(services, connectTimeoutS, readTimeoutS, totalTimeoutS, maxConnections, nSamples, windowS,
+                    validators):
+    # Certificates are not verified, as before.
+    connector = aiohttp.TCPConnector(ssl=False, limit=maxConnections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Samples for each service are spread evenly over the window, and all services are probed concurrently.
+        delays = [windowS * idx / nSamples for idx in range(nSamples)]
+        results = await asyncio.gather(
+            *[_probe(session, service, connectTimeoutS, readTimeoutS, totalTimeoutS, delayS=delayS, validator=validator)
+              for service, validator in zip(services, validators) for delayS in delays])
+    return [results[idx:idx + nSamples] for idx in range(0, len(results), nSamples)]
+
+
+def probeServices(services, connectTimeoutS=DEFAULT_CONNECT_TIMEOUT_S, readTimeoutS=DEFAULT_READ_TIMEOUT_S,
+                  totalTimeoutS=DEFAULT_TOTAL_TIMEOUT_S, maxConnections=100, nSamples=1, windowS=0, validators=None):
+    """
+    Probe the endpoints of all <services> concurrently over a shared connection pool.
+
+    Parameters:
+    -----------
+    services : list of dict
+        Services to probe, each with an "endpoint" and optionally "connect_timeout_s", "read_timeout_s" and
+        "total_timeout_s" to override the defaults.
+    connectTimeoutS : float, optional
+        Default timeout for establishing a connection.
+    readTimeoutS : float, optional
+        Default timeout between reads of the response.
+    totalTimeoutS : float, optional
+        Default timeout for the whole request, including reading the response.
+    maxConnections : int, optional
+        The maximum number of simultaneous connections.
+    nSamples : int, optional
+        The number of requests to make to each service.
+    windowS : float, optional
+        The window over which to spread each service's requests in seconds.
+    validators : list of ContentValidator, optional
+        A validator for each service, in order, to check response bodies with as they are read.
+
+    Returns:
+    --------
+    list of list of dict
+        For each service, in order, a list with the result of each request: the response status code and content
+        (None if it was validated as it was read), the content validation error (content_error) if a validator was
+        given, time to first byte (ttfb_s) and total latency (latency_s) in seconds, and an error if the request
+        failed.
+    """
+    if validators is None:
+        validators = [None] * len(services)
+    return asyncio.run(
+        _probeAll(services, connectTimeoutS, readTimeoutS, totalTimeoutS, maxConnections, nSamples, windowS,
+                  validators))
@@ -0,0 +1,94 @@
+from datetime import datetime
+import json
+import math
+import os
+
+
+class LatencyHistograms():
+    """
+    Rolling, log-bucketed latency histograms persisted to a JSON file on local disk.
+
+    Latencies are counted in buckets whose boundaries grow geometrically, so that every value is recorded to within
+    a relative error of 1/<bucketsPerDoubling> of a doubling regardless of magnitude (in the style of an HDR
+    histogram). A histogram is kept per key and per run, and only the most recent <maxRuns> runs are kept, so
+    percentiles calculated from the merged histograms cover a rolling window.
+    """
+
+    MIN_LATENCY_S = 1e-4
+
+    def __init__(self, path, maxRuns=96, bucketsPerDoubling=16):
+        """
+        :param path: The path of the JSON file to load from and save to.
+        :param maxRuns: The number of runs to keep.
+        :param bucketsPerDoubling: The number of buckets per doubling of latency.
+        """
+        self.path = path
+        self.maxRuns = maxRuns
+        self.bucketsPerDoubling = bucketsPerDoubling
+
+        self.runs = {}      # key -> list of {"at": ..., "counts": {bucket: count}}
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+            # Bucket boundaries must match those of previous runs.
+            self.bucketsPerDoubling = data.get("bucketsPerDoubling", bucketsPerDoubling)
+            self.runs = data.get("runs", {})
+        self._current = {}
+
+    def _bucket(self, latencyS):
+        return int(math.floor(math.log2(max(latencyS, self.MIN_LATENCY_S) / self.MIN_LATENCY_S)
+                              * self.bucketsPerDoubling))
+
+    def _value(self, bucket):
+        """ Get the upper bound of a bucket in seconds. """
+        return self.MIN_LATENCY_S * 2 ** ((int(bucket) + 1) / self.bucketsPerDoubling)
+
+    def record(self, key, latencyS):
+        """ Record a latency for <key> in the current run. """
+        counts = self._current.setdefault(key, {})
+        bucket = str(self._bucket(latencyS))
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    def percentiles(self, key, percentiles=(50, 95, 99)):
+        """
+        Calculate percentiles of the latencies recorded for <key> across the rolling window (including the current
+        run), to the resolution of a bucket.
+
+        Returns a dictionary keyed by "p<percentile>", with None values if nothing has been recorded.
+        """
+        merged = {}
+        for counts in [run["counts"] for run in self.runs.get(key, [])] + [self._current.get(key, {})]:
+            for bucket, count in counts.items():
+                merged[int(bucket)] = merged.get(int(bucket), 0) + count
+        total = sum(merged.values())
+
+        result = {}
+        for percentile in percentiles:
+            name = "p{}".format(percentile)
+            result[name] = None
+            if not total:
+                continue
+            cumulative = 0
+            for bucket in sorted(merged):
+                cumulative += merged[bucket]
+                if cumulative >= total * percentile / 100.:
+                    result[name] = self._value(bucket)
+                    break
+        return result
+
+    def save(self):
+        """ Add the current run to the rolling window and write the histograms to disk. """
+        at = datetime.now().isoformat()
+        for key, counts in self._current.items():
+            runs = self.runs.setdefault(key, [])
+            runs.append({"at": at, "counts": counts})
+            del runs[:-self.maxRuns]
+        self._current = {}
+
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmpPath = "{}.tmp".format(self.path)
+        with open(tmpPath, 'w') as f:
+            json.dump({"bucketsPerDoubling": self.bucketsPerDoubling, "runs": self.runs}, f)
+        os.replace(tmpPath, self.path)
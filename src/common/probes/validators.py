@@ -0,0 +1,202 @@
+import io
+import json
+import re
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+MATCH_MODES = ('exact', 'subset')
+_PATH_TOKEN = re.compile(r"\.([^.\[\]]+)|\[(\d+)\]")
+_MISSING = object()
+_JSON_ERRORS = (ValueError, ijson.JSONError) if ijson is not None else (ValueError,)
+
+
+def _parsePath(path):
+    """ Parse a JSONPath-style path, e.g. $.a.b[0].c, into a tuple of keys and indices. """
+    if not path.startswith('$'):
+        raise ValueError("Path {} must start with $".format(path))
+    parts = []
+    position = 1
+    for match in _PATH_TOKEN.finditer(path, 1):
+        if match.start() != position:
+            break
+        parts.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        position = match.end()
+    if position != len(path):
+        raise ValueError("Could not parse path {}".format(path))
+    return tuple(parts)
+
+
+def _resolve(document, parts):
+    for part in parts:
+        try:
+            document = document[part]
+        except (KeyError, IndexError, TypeError):
+            return _MISSING
+    return document
+
+
+def _isSubset(expected, actual):
+    """ Check that <expected> is contained in <actual>: dictionaries may have extra keys, recursively. """
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and _isSubset(value, actual[key]) for key, value in expected.items())
+    if isinstance(expected, list):
+        return isinstance(actual, list) and len(expected) == len(actual) and all(
+            _isSubset(e, a) for e, a in zip(expected, actual))
+    return expected == actual
+
+
+class _PathExtractor():
+    """ Build the values at a set of dotted ijson prefixes from a stream of ijson parse events. """
+
+    def __init__(self, prefixes):
+        self.wanted = {prefix: parts for parts, prefix in prefixes.items()}
+        self.builders = {}
+        self.done = set()
+
+    def feed(self, prefix, event, value):
+        """ Feed a parse event, returning True once the values at all prefixes have been built. """
+        for wantedPrefix in self.wanted:
+            if wantedPrefix in self.done:
+                continue
+            if prefix == wantedPrefix or prefix.startswith(wantedPrefix + '.'):
+                self.builders.setdefault(wantedPrefix, ijson.ObjectBuilder()).event(event, value)
+                if prefix == wantedPrefix and event not in ('start_map', 'start_array', 'map_key'):
+                    self.done.add(wantedPrefix)
+        return len(self.done) == len(self.wanted)
+
+    def values(self):
+        return {parts: self.builders[prefix].value if prefix in self.done else _MISSING
+                for prefix, parts in self.wanted.items()}
+
+
+class ContentValidator():
+    """
+    Check a response body against a service's expected content.
+
+    The expectation is compiled once and then applied to many bodies. Supported checks are:
+    - <expected>: the body must equal (match="exact") or contain (match="subset") this JSON document,
+    - <paths>: a dictionary of JSONPath-style paths (e.g. $.a.b[0]) to the value expected at each path,
+    - <regexes>: a dictionary of paths to regular expressions searched for in the (string) value at each path. The
+      path $ refers to the raw body, which doesn't need to be JSON.
+
+    Each body is parsed at most once. If only paths without indices are checked, the body is larger than
+    <streamThresholdBytes> and ijson is installed, only the values at those paths are built while streaming through
+    the body. If the raw body isn't checked either, the body can be validated as it is read from the response with
+    validateStream(), so that it is never held in memory in full.
+    """
+
+    def __init__(self, expected=None, match="exact", paths=None, regexes=None, streamThresholdBytes=1048576):
+        if match not in MATCH_MODES:
+            raise ValueError("Unknown match mode {}, expected one of {}".format(match, " || ".join(MATCH_MODES)))
+        self.expected = expected
+        self.match = match
+        self.paths = [(path, _parsePath(path), value) for path, value in (paths or {}).items()]
+        self.regexes = [(path, _parsePath(path), re.compile(pattern)) for path, pattern in (regexes or {}).items()]
+        self.streamThresholdBytes = streamThresholdBytes
+
+        self._rawRegexes = [(path, pattern) for path, parts, pattern in self.regexes if not parts]
+        self._pathRegexes = [(path, parts, pattern) for path, parts, pattern in self.regexes if parts]
+        checkedPaths = [parts for _, parts, _ in self.paths] + [parts for _, parts, _ in self._pathRegexes]
+        self._needsDocument = bool(self.expected) or any(not parts for _, parts, _ in self.paths)
+        self._needsJSON = self._needsDocument or bool(checkedPaths)
+        self._streamable = ijson is not None and not self._needsDocument and all(
+            isinstance(part, str) for parts in checkedPaths for part in parts)
+        self._streamPrefixes = {parts: '.'.join(parts) for parts in checkedPaths} if self._streamable else {}
+
+    @classmethod
+    def fromService(cls, svc):
+        """ Compile a validator from a service definition in the task kwargs. """
+        return cls(
+            expected=svc.get('expected_content'),
+            match=svc.get('content_match', 'exact'),
+            paths=svc.get('content_paths'),
+            regexes=svc.get('content_regex')
+        )
+
+    def streams(self, contentLength):
+        """
+        Check whether a response body of <contentLength> bytes (None if unknown) should be validated as it is read
+        with validateStream(), rather than read in full and passed to validate().
+        """
+        return self._needsJSON and self._streamable and not self._rawRegexes and (
+            contentLength is None or contentLength > self.streamThresholdBytes)
+
+    def _extract(self, body):
+        """ Build only the values at the checked paths while streaming through <body>. """
+        extractor = _PathExtractor(self._streamPrefixes)
+        for prefix, event, value in ijson.parse(io.BytesIO(body), use_float=True):
+            if extractor.feed(prefix, event, value):
+                break
+        return extractor.values()
+
+    async def _extractAsync(self, stream):
+        """ Build only the values at the checked paths while reading <stream>, stopping once all are found. """
+        extractor = _PathExtractor(self._streamPrefixes)
+        async for prefix, event, value in ijson.parse_async(stream, use_float=True):
+            if extractor.feed(prefix, event, value):
+                break
+        return extractor.values()
+
+    def _checkPaths(self, lookup):
+        """ Check the values at the checked paths, as given by <lookup>, returning an error message or None. """
+        for path, parts, value in self.paths:
+            actual = lookup(parts)
+            if actual is _MISSING:
+                return "content mismatch, {} not found".format(path)
+            if actual != value:
+                return "content mismatch at {}, expected {} got {}".format(path, repr(value), repr(actual))
+        for path, parts, pattern in self._pathRegexes:
+            actual = lookup(parts)
+            if actual is _MISSING:
+                return "content mismatch, {} not found".format(path)
+            if not pattern.search(str(actual)):
+                return "content mismatch at {}, {} does not match {}".format(path, repr(actual), pattern.pattern)
+        return None
+
+    async def validateStream(self, stream):
+        """
+        Validate a response body as it is read from <stream> (an object with an async read(n), e.g. an aiohttp
+        response's content), returning an error message or None. Only valid if streams() is true.
+        """
+        try:
+            values = await self._extractAsync(stream)
+        except _JSON_ERRORS as e:
+            return "content is not valid JSON: {}".format(e)
+        return self._checkPaths(values.get)
+
+    def validate(self, body):
+        """ Validate a response body (bytes or str), returning an error message or None. """
+        if isinstance(body, bytes):
+            text = None
+        else:
+            text, body = body, body.encode()
+
+        for path, pattern in self._rawRegexes:
+            if text is None:
+                text = body.decode(errors="replace")
+            if not pattern.search(text):
+                return "content mismatch, {} does not match {}".format(path, pattern.pattern)
+        if not self._needsJSON:
+            return None
+
+        try:
+            if self._streamable and len(body) > self.streamThresholdBytes:
+                values = self._extract(body)
+                lookup = values.get
+            else:
+                document = json.loads(body)
+                lookup = lambda parts: _resolve(document, parts)
+        except _JSON_ERRORS as e:
+            return "content is not valid JSON: {}".format(e)
+
+        if self.expected:
+            if self.match == "exact" and document != self.expected:
+                return "content mismatch, expected {} got {}".format(repr(self.expected), repr(document))
+            if self.match == "subset" and not _isSubset(self.expected, document):
+                return "content mismatch, expected a superset of {} got {}".format(
+                    repr(self.expected), repr(document))
+        return self._checkPaths(lookup)
@@ -1,57 +1,163 @@
+from collections import Counter, OrderedDict
 from datetime import datetime
 import logging
+from threading import Lock
 
 from rucio.client.client import Client
+from rucio.common.exception import DataIdentifierAlreadyExists
 
 
-def createCollection(loggerName, scope, name=None, collectionType="DATASET"):
-    """ Create a new collection in scope, <scope>. """
+# Collections known to exist, as an LRU of DIDs, so that repeat calls within a process skip the Rucio server.
+#
+KNOWN_COLLECTIONS_MAXSIZE = 4096
+_knownCollections = OrderedDict()
+_knownCollectionsLock = Lock()
+
+
+def _isKnownCollection(did):
+    with _knownCollectionsLock:
+        if did in _knownCollections:
+            _knownCollections.move_to_end(did)
+            return True
+        return False
+
+
+def _addKnownCollection(did):
+    with _knownCollectionsLock:
+        _knownCollections[did] = None
+        _knownCollections.move_to_end(did)
+        while len(_knownCollections) > KNOWN_COLLECTIONS_MAXSIZE:
+            _knownCollections.popitem(last=False)
+
+
+def _defaultCollectionName(collectionType):
+    """ Get a collection name according to datestamp. """
+    name = datetime.now().strftime("%d-%m-%Y")
+    if collectionType == "CONTAINER":
+        name = "container_{}".format(name)
+    return name
+
+
+def createCollection(loggerName, scope, name=None, collectionType="DATASET", client=None):
+    """
+    Create a new collection in scope, <scope>, if it doesn't already exist.
+
+    The collection is added directly, treating DataIdentifierAlreadyExists as success, rather than checking for it
+    first. Collections created or found are remembered for the lifetime of the process.
+    """
 
     logger = logging.getLogger(loggerName)
 
     # If name is not specified, create one according to datestamp.
     #
     if name is None:
-        name = datetime.now().strftime("%d-%m-%Y")
-        if collectionType == "CONTAINER":
-            name = "container_{}".format(name)
+        name = _defaultCollectionName(collectionType)
 
     # Create container DID according to <scope>:<name> format.
     #
     did = "{}:{}".format(scope, name)
+    if _isKnownCollection(did):
+        logger.debug("DID {} already known to exist. Skipping.".format(did))
+        return did
 
-    logger.info("Checking to see if DID ({}) already exists...".format(did))
+    logger.info("Adding DID {} of type {} if it doesn't already exist...".format(did, collectionType))
     try:
-        # Check to see if DID already exists, and if not, add.
-        client = Client(logger=logger)
-
-        found = True if len(list(
-            client.list_dids(scope=scope, filters=[{'name': name}], did_type="all", recursive=False))) > 0 else False
-        if found:
-            logger.debug("DID already exists. Skipping.")
-        else:
-            logger.debug("Adding DID {} of type {}".format(did, collectionType))
-            try:
-                tokens = did.split(":")
-                scope = tokens[0]
-                name = tokens[1]
-                client.add_did(scope=scope, name=name, did_type=collectionType)
-            except Exception as e:
-                logger.critical("Error adding did.")
-                logger.critical(repr(e))
-                return False
+        if client is None:
+            client = Client(logger=logger)
+        client.add_did(scope=scope, name=name, did_type=collectionType)
+    except DataIdentifierAlreadyExists:
+        logger.debug("DID already exists. Skipping.")
     except Exception as e:
-        logger.critical("Error listing collection.")
+        logger.critical("Error adding did.")
         logger.critical(repr(e))
         return False
 
+    _addKnownCollection(did)
     return did
 
 
+def createCollections(loggerName, scope, names, collectionType="DATASET", client=None):
+    """
+    Create many new collections in scope, <scope>, with a single add_dids request.
+
+    If any of the collections already exist the bulk request is rejected, in which case each collection is created
+    individually with createCollection.
+
+    Returns a list of DIDs in the same order as <names>, with False for collections that could not be created.
+    """
+    logger = logging.getLogger(loggerName)
+    dids = ["{}:{}".format(scope, name) for name in names]
+    toAdd = [name for name, did in zip(names, dids) if not _isKnownCollection(did)]
+    if not toAdd:
+        return dids
+    if client is None:
+        client = Client(logger=logger)
+    logger.info("Adding {} DIDs of type {}...".format(len(toAdd), collectionType))
+    try:
+        client.add_dids([{"scope": scope, "name": name, "type": collectionType} for name in toAdd])
+    except DataIdentifierAlreadyExists:
+        logger.debug("Some DIDs already exist, adding individually...")
+        return [createCollection(loggerName, scope, name, collectionType=collectionType, client=client)
+                for name in names]
+    except Exception as e:
+        logger.critical("Error adding dids.")
+        logger.critical(repr(e))
+        return [did if _isKnownCollection(did) else False for did in dids]
+    for name in toAdd:
+        _addKnownCollection("{}:{}".format(scope, name))
+    return dids
+
+
+def _freeze(value):
+    """ Convert <value> to a hashable equivalent, recursing into lists, sets and dictionaries. """
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(_freeze(item) for item in value)
+    return value
+
+
+def findMissingRules(target_rules, found_rules, match_keys=('copies', 'rse_expression')):
+    """
+    Find the target rules that are not present in the list of found rules, matching on specified keys.
+
+    Found rules are indexed as a multiset keyed on their <match_keys> values, so that each target rule consumes a
+    distinct found rule (duplicate target rules require duplicate found rules) and the comparison is linear in the
+    number of rules.
+
+    Parameters:
+    -----------
+    target_rules : list of dict
+        Target rules to be matched.
+    found_rules : list of dict
+        Found rules to search within.
+    match_keys : list of str, optional
+        Keys to match (default is ['copies', 'rse_expression']).
+
+    Returns:
+    --------
+    list of dict
+        The target rules without a matching found rule, in the order given.
+    """
+    available = Counter(tuple(_freeze(rule.get(key)) for key in match_keys) for rule in found_rules)
+    missing = []
+    for target_rule in target_rules:
+        key = tuple(_freeze(target_rule.get(key)) for key in match_keys)
+        if available[key] > 0:
+            available[key] -= 1
+        else:
+            missing.append(target_rule)
+    return missing
+
+
 def matchRules(loggerName, target_rules, found_rules, match_keys=['copies', 'rse_expression']):
     """
     Checks if all target rules are present in the list of found rules by matching specified keys.
 
+    Each target rule must be matched by a distinct found rule (see findMissingRules).
+
     Parameters:
     -----------
     loggerName : str
@@ -69,13 +175,7 @@ def matchRules(loggerName, target_rules, found_rules, match_keys=['copies', 'rse
         True if all target rules are matched in the found rules, otherwise False.
     """
     logger = logging.getLogger(loggerName)
-    for target_rule in target_rules:
-        matched = False
-        for found_rule in found_rules:
-            if all(found_rule.get(key) == target_rule.get(key) for key in match_keys):
-                matched = True
-                break
-        if not matched:
-            logger.debug("Expected rule {} not found.".format(target_rule))
-            return False
-    return True
+    missing = findMissingRules(target_rules, found_rules, match_keys=match_keys)
+    for target_rule in missing:
+        logger.debug("Expected rule {} not found.".format(target_rule))
+    return not missing
@@ -0,0 +1,178 @@
+import os
+from threading import Lock
+import time
+
+from common.polling import Poller
+from utility import calculatePercentiles
+
+# Wildcard name filters need at least this many literal leading characters, so a poll never lists the whole scope.
+MIN_NAME_PREFIX_LENGTH = 4
+
+
+def _nameFilters(names):
+    """
+    Get the list_dids name filters covering <names>: one wildcard filter per group of names sharing their first
+    MIN_NAME_PREFIX_LENGTH characters (a single filter for files generated by a test, which share a prefix), and
+    exact filters for names that are too short or share no prefix with another name.
+    """
+    groups = {}
+    for name in names:
+        groups.setdefault(name[:MIN_NAME_PREFIX_LENGTH], []).append(name)
+    filters = []
+    for prefix, group in groups.items():
+        if len(group) > 1 and len(prefix) == MIN_NAME_PREFIX_LENGTH:
+            filters.append(os.path.commonprefix(group) + "*")
+        else:
+            filters += group
+    return filters
+
+
+class IngestionPoller():
+    """
+    Poll for a set of files to be ingested into scope, <scope>, and for their metadata to be set.
+
+    Each round lists the DIDs in the scope matching the names of all outstanding files with a single list_dids request
+    per group of names sharing a prefix (usually one, as files written by a test share a prefix). Metadata is then only
+    fetched for DIDs that are visible but have not yet been seen with the expected metadata, so that files are checked
+    in parallel rather than one after the other.
+
+    The times at which each DID first became visible and its metadata first matched are recorded, so that ingestion
+    latencies can be calculated relative to when each file was written.
+
+    Files may be added from another thread while polling is in progress.
+    """
+
+    def __init__(self, logger, didClient, scope, expectedMetadata):
+        """
+        :param logger: The logger instance to be used for logging.
+        :param didClient: A Rucio DIDClient.
+        :param scope: The scope files are ingested to.
+        :param expectedMetadata: A function taking a file name and returning the metadata expected for it.
+        """
+        self.logger = logger
+        self.didClient = didClient
+        self.scope = scope
+        self.expectedMetadata = expectedMetadata
+
+        self.files = {}     # name -> {"state": ..., "error": ..., "written_at": ..., ...}
+        self._lock = Lock()
+
+    def add(self, name, writtenAt=None, size=None):
+        """ Start polling for file with name, <name>, and size <size>, written at epoch time <writtenAt>. """
+        with self._lock:
+            self.files[name] = {
+                "state": "PENDING",
+                "error": None,
+                "size": size,
+                "written_at": writtenAt if writtenAt is not None else time.time(),
+                "visible_at": None,
+                "matched_at": None,
+            }
+
+    def _withState(self, *states):
+        with self._lock:
+            return [name for name, f in self.files.items() if f["state"] in states]
+
+    @property
+    def outstanding(self):
+        """ Get the names of files that have not yet succeeded or failed. """
+        return self._withState("PENDING", "VISIBLE")
+
+    @property
+    def succeeded(self):
+        return self._withState("SUCCEEDED")
+
+    @property
+    def failed(self):
+        return self._withState("FAILED")
+
+    def _fail(self, name, error):
+        self.files[name]["state"] = "FAILED"
+        self.files[name]["error"] = error
+
+    def pollRound(self):
+        """ Check all outstanding files once. Returns the number of files still outstanding. """
+        pending = self._withState("PENDING")
+        if pending:
+            listed = set()
+            for pattern in _nameFilters(pending):
+                try:
+                    listed.update(self.didClient.list_dids(self.scope, filters=[{"name": pattern}], did_type="file"))
+                except Exception as e:
+                    self.logger.critical("Error encountered when polling for data {}".format(e))
+            now = time.time()
+            for name in pending:
+                if name in listed:
+                    self.files[name]["state"] = "VISIBLE"
+                    self.files[name]["visible_at"] = now
+
+        # Metadata is set via a separate call following file ingestion, so check it for visible files only, and keep
+        # checking until it matches.
+        for name in self._withState("VISIBLE"):
+            try:
+                retrievedMeta = self.didClient.get_metadata(self.scope, name, plugin="POSTGRES_JSON")
+            except Exception as e:
+                self.logger.critical("Error encountered when polling for data {}".format(e))
+                self._fail(name, repr(e))
+                continue
+            if retrievedMeta == self.expectedMetadata(name):
+                self.logger.info("DID found with expected metadata: {}:{}".format(self.scope, name))
+                self.files[name]["state"] = "SUCCEEDED"
+                self.files[name]["matched_at"] = time.time()
+        return len(self.outstanding)
+
+    def run(self, deadlineS, maxIntervalS, initialIntervalS=1):
+        """
+        Poll until no files are outstanding or <deadlineS> seconds pass, starting with an interval of
+        <initialIntervalS> seconds and backing off up to <maxIntervalS> seconds.
+        """
+        poller = Poller(
+            self.logger, initialIntervalS=initialIntervalS, maxIntervalS=maxIntervalS, deadlineS=deadlineS)
+        poller.poll(self.pollRound, lambda nOutstanding: nOutstanding == 0,
+                    description="ingestion of {} DIDs".format(len(self.outstanding)))
+
+        for name in self._withState("VISIBLE"):
+            self.logger.critical("Metadata mismatch for DID: {}".format(name))
+            self._fail(name, "metadata mismatch")
+        for name in self._withState("PENDING"):
+            self.logger.critical("DID {}:{} not found after {} sec".format(self.scope, name, deadlineS))
+            self._fail(name, "not found")
+        return len(self.succeeded), len(self.failed)
+
+    def latencies(self, names=None):
+        """
+        Get the ingestion latency (time from file written to DID visible with expected metadata) of each file in
+        <names> (default all, in the order they were added), with None for files that did not succeed.
+        """
+        if names is None:
+            with self._lock:
+                names = list(self.files)
+        latencies = []
+        for name in names:
+            f = self.files[name]
+            latencies.append(f["matched_at"] - f["written_at"] if f["matched_at"] is not None else None)
+        return latencies
+
+    def summary(self):
+        """
+        Summarise per-file latencies as percentiles and a compact per-file array (ms, in order added), along with
+        the ingestion throughput from the first file written to the last file ingested.
+        """
+        with self._lock:
+            files = list(self.files.values())
+        ingestion = [latency for latency in self.latencies() if latency is not None]
+        visibility = [f["visible_at"] - f["written_at"] for f in files if f["visible_at"] is not None]
+
+        summary = {}
+        for key, value in calculatePercentiles(ingestion).items():
+            summary["ingestion_latency_{}_s".format(key)] = value
+        for key, value in calculatePercentiles(visibility).items():
+            summary["visibility_latency_{}_s".format(key)] = value
+        summary["ingestion_latencies_ms"] = [
+            int(latency * 1000) if latency is not None else None for latency in self.latencies()]
+
+        ingested = [f for f in files if f["matched_at"] is not None]
+        elapsed = max(f["matched_at"] for f in ingested) - min(f["written_at"] for f in files) if ingested else 0
+        summary["ingest_throughput_files_per_s"] = len(ingested) / elapsed if elapsed else None
+        summary["ingest_throughput_bytes_per_s"] = sum(f["size"] or 0 for f in ingested) / elapsed if elapsed else None
+        return summary
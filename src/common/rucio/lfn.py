@@ -1,4 +1,6 @@
 class LFN():
+    __slots__ = ('_abspath',)
+
     def __init__(self, abspath):
         self._abspath = abspath
 
@@ -1,10 +1,12 @@
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import itertools
 import os
 import uuid
 
 from common.rucio.lfn import LFN
-from common.rucio.pfn import PFN
+from common.rucio.pfn import PFN, PFNBatch
 from utility import generateRandomFile
 
 
@@ -15,46 +17,89 @@ class LFNPFNSpoofer():
         self._hostname = hostname
         self._prefix = prefix
         self._scope = scope
-        self.mapping = []           # list of (LFN, PFN) tuples.
+        self._lfns = []             # LFNs, parallel to self._pfns.
+        self._pfns = PFNBatch()
 
     def __del__(self):
         """ Remove all lfns. """
-        for lfn in self.lfns:
+        for lfn in self._lfns:
             try:
                 os.remove(lfn.abspath)
             except FileNotFoundError:
                 pass
 
+    def __iter__(self):
+        """ Iterate over (LFN, PFN) tuples. """
+        return zip(self._lfns, self._pfns)
+
+    def __len__(self):
+        return len(self._lfns)
+
+    def add(self, lfn, pfn):
+        """ Add an LFN/PFN pair to the mapping. """
+        self._lfns.append(lfn)
+        self._pfns.append(pfn)
+
     @abstractmethod
-    def spoof(self):
+    def ispoof(self, kwargs):
         """
-        Method for generating a list of LFN/PFN tuples.
+        Generator yielding LFN/PFN tuples, adding each to the mapping as it is generated.
         """
         raise NotImplementedError
 
+    def spoof(self, kwargs):
+        """
+        Method for generating a list of LFN/PFN tuples.
+        """
+        for _ in self.ispoof(kwargs):
+            pass
+
+    @property
+    def mapping(self):
+        """ Get a list of (LFN, PFN) tuples. """
+        return list(self)
+
     @property
     def lfns(self):
         """ Get LFNs from mapping. """
-        lfns, _ = zip(*self.mapping)
-        return lfns
+        return self._lfns
 
     @property
     def pfns(self):
         """ Get PFNs from mapping. """
-        _, pfns = zip(*self.mapping)
-        return pfns
+        return self._pfns
 
 
 class LFNPFNSpoofer_SKAO_Testing_v1(LFNPFNSpoofer):
     """
         Spoofs PFN with schema:
         scope/test_dir_prefix_<timestamp>/project<pi>/dataset<di>/<fi>_<uuid>
+
+        The timestamp is taken once per call to spoof/ispoof, so that all files from a call share a directory.
+        Local files are written in parallel, in chunks of <chunk_size>, with <n_threads> threads. All files share a
+        single random payload.
     """
 
     def __init__(self, logger, scheme, hostname, prefix, scope):
         super().__init__(logger, scheme, hostname, prefix, scope)
 
-    def spoof(self, kwargs):
+    def iterpfns(self, nProjects, nDatasetsPerProject, nFilesPerDataset, test_dir_prefix):
+        """ Generator yielding PFNs following the naming schema. """
+        timestamp = datetime.datetime.now().strftime("%d%m%yT%H.%M.%S")
+        for pi in range(0, nProjects):
+            for di in range(0, nDatasetsPerProject):
+                dir = os.path.join(
+                    self._scope,
+                    self._prefix,
+                    test_dir_prefix + '_' + timestamp,
+                    "project{}".format(pi),
+                    "dataset{}".format(di)
+                )
+                for fi in range(0, nFilesPerDataset):
+                    name = "{}_{}".format(fi, str(uuid.uuid4()))
+                    yield PFN(self._scheme, self._hostname, dir, name)
+
+    def ispoof(self, kwargs):
         try:
             # Assign variables from kwargs.
             #
@@ -63,30 +108,24 @@ class LFNPFNSpoofer_SKAO_Testing_v1(LFNPFNSpoofer):
             nProjects = kwargs["n_projects"]
             size = kwargs['size']
             test_dir_prefix = kwargs["test_dir_prefix"]
+            nThreads = kwargs.get("n_threads", 8)
+            chunkSize = kwargs.get("chunk_size", 1000)
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg.")
             self.logger.critical(repr(e))
-            return False
-
-        # Create PFN paths following naming schema.
-        #
-        pfns = []
-        for pi in range(0, nProjects):
-            for di in range(0, nDatasetsPerProject):
-                for fi in range(0, nFilesPerDataset):
-                    timestamp = datetime.datetime.now().strftime("%d%m%yT%H.%M.%S")
-                    dir = os.path.join(
-                        self._scope,
-                        self._prefix,
-                        test_dir_prefix + '_' + timestamp,
-                        "project{}".format(pi),
-                        "dataset{}".format(di)
-                    )
-                    name = "{}_{}".format(fi, str(uuid.uuid4()))
-                    pfns.append(PFN(self._scheme, self._hostname, dir, name))
+            return
 
-        # Generate local files to map to these PFN and return as a list of tuples.
+        # Create PFN paths following naming schema, and generate local files to map to these PFNs.
         #
-        lfns = [LFN(generateRandomFile(size, prefix=str(uuid.uuid4())).name)
-                for pfn in pfns]
-        self.mapping += [(lfn, pfn) for lfn, pfn in zip(lfns, pfns)]
+        payload = os.urandom(size)
+        pfns = self.iterpfns(nProjects, nDatasetsPerProject, nFilesPerDataset, test_dir_prefix)
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            while True:
+                chunk = list(itertools.islice(pfns, chunkSize))
+                if not chunk:
+                    break
+                lfns = executor.map(
+                    lambda _: LFN(generateRandomFile(size, prefix=str(uuid.uuid4()), payload=payload).name), chunk)
+                for lfn, pfn in zip(lfns, chunk):
+                    self.add(lfn, pfn)
+                    yield lfn, pfn
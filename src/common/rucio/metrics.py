@@ -0,0 +1,8 @@
+from metrics import REGISTRY
+
+# Upload metrics, shared by all tasks that upload files.
+#
+UPLOAD_BYTES = REGISTRY.counter("upload_bytes_total", "Bytes successfully uploaded.", ("task", "rse"))
+UPLOADS = REGISTRY.counter("uploads_total", "Number of uploads by outcome.", ("task", "rse", "outcome"))
+UPLOAD_RATE = REGISTRY.histogram("upload_rate_bytes_per_second", "Upload rate of successful uploads.", ("task", "rse"),
+                                 buckets=(1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9))
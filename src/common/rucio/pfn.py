@@ -1,7 +1,12 @@
 import os
+import sys
 
 
 class PFN():
+    """ A physical file name, <scheme>://<hostname>/<dir>/<name>. """
+
+    __slots__ = ('_scheme', '_hostname', '_dir', '_name', '_abspath', '_dirname')
+
     def __init__(self, scheme, hostname, dir, name):
         self._scheme = scheme.strip('/')
         self._hostname = hostname.strip('/')
@@ -10,29 +15,34 @@ class PFN():
         else:
             self._dir = dir.lstrip('/').rstrip('/')
         self._name = name.lstrip('/')
+        self._abspath = None
+        self._dirname = None
+
+    @staticmethod
+    def parse(abspath):
+        """ Split an abspath into a (scheme, hostname, dir, name) tuple in a single pass. """
+        scheme, _, rest = abspath.partition('://')
+        hostname, _, path = rest.partition('/')
+        dir, _, name = path.rpartition('/')
+        return scheme, hostname, dir, name
 
     @classmethod
     def fromabspath(cls, abspath):
         """ Deconstruct to PFN from abspath. """
-        scheme = abspath.split('://')[0]
-        hostname = abspath.split('://')[1].split('/')[0]
-        if scheme == "root":
-            dir = '/'.join(abspath.split('://')[1].split('/')[1:-1])
-        else:
-            dir = '/' + '/'.join(abspath.split('://')[1].split('/')[1:-1])
-        name = abspath.split('://')[1].split('/')[-1]
-        return cls(scheme, hostname, dir, name)
+        return cls(*cls.parse(abspath))
 
     @property
     def abspath(self):
-        return '{}://{}/{}'.format(
-            self._scheme,
-            self._hostname,
-            os.path.join(
-                self._dir,
-                self._name,
+        if self._abspath is None:
+            self._abspath = '{}://{}/{}'.format(
+                self._scheme,
+                self._hostname,
+                os.path.join(
+                    self._dir,
+                    self._name,
+                )
             )
-        )
+        return self._abspath
 
     @property
     def dir(self):
@@ -40,8 +50,73 @@ class PFN():
 
     @property
     def dirname(self):
-        return os.path.dirname(self.abspath)
+        if self._dirname is None:
+            self._dirname = os.path.dirname(self.abspath)
+        return self._dirname
 
     @property
     def name(self):
         return self._name
+
+
+class PFNBatch():
+    """
+    A columnar container for a large number of PFNs.
+
+    PFNs are stored as parallel lists of their components rather than as individual objects. Schemes, hostnames
+    and directories are interned, since they are typically shared by many PFNs. PFN objects are only created on
+    access.
+    """
+
+    __slots__ = ('_schemes', '_hostnames', '_dirs', '_names')
+
+    def __init__(self):
+        self._schemes = []
+        self._hostnames = []
+        self._dirs = []
+        self._names = []
+
+    @classmethod
+    def fromabspaths(cls, abspaths):
+        """ Construct a batch from an iterable of abspaths. """
+        batch = cls()
+        for abspath in abspaths:
+            batch.appendabspath(abspath)
+        return batch
+
+    def append(self, pfn):
+        """ Append a PFN. """
+        self._schemes.append(sys.intern(pfn._scheme))
+        self._hostnames.append(sys.intern(pfn._hostname))
+        self._dirs.append(sys.intern(pfn._dir))
+        self._names.append(pfn._name)
+
+    def appendabspath(self, abspath):
+        """ Append a PFN from its abspath. """
+        self.append(PFN.fromabspath(abspath))
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, idx):
+        pfn = PFN.__new__(PFN)
+        pfn._scheme = self._schemes[idx]
+        pfn._hostname = self._hostnames[idx]
+        pfn._dir = self._dirs[idx]
+        pfn._name = self._names[idx]
+        pfn._abspath = None
+        pfn._dirname = None
+        return pfn
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    @property
+    def abspaths(self):
+        """ Get a generator of abspaths. """
+        return (pfn.abspath for pfn in self)
+
+    @property
+    def names(self):
+        return self._names
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+import time
+
+from rucio.client.client import Client
+
+from common.polling import Poller
+from utility import calculatePercentiles
+
+RUCIO_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S UTC"
+
+
+class RuleTracker():
+    """
+    Track replication rules until they reach a final state (OK or STUCK) or a deadline passes.
+
+    Rule states are polled in batches on an adaptive interval (with jitter) that starts at <initialIntervalS> and is
+    multiplied by <backoffFactor> after each round, up to <maxIntervalS>. If <filters> are given, each round lists all
+    matching rules with a single list_replication_rules request and picks out the tracked ones, otherwise each pending
+    rule is fetched individually.
+
+    Times to reach a final state are measured from the submission time passed to add() and have a resolution of
+    the polling interval.
+    """
+
+    FINAL_STATES = ('OK', 'STUCK')
+
+    def __init__(self, logger, client=None, filters=None, initialIntervalS=5, maxIntervalS=60, backoffFactor=2,
+                 deadlineS=3600):
+        self.logger = logger
+        self.client = client if client is not None else Client(logger=logger)
+        self.filters = filters
+        self.initialIntervalS = initialIntervalS
+        self.maxIntervalS = maxIntervalS
+        self.backoffFactor = backoffFactor
+        self.deadlineS = deadlineS
+
+        self.rules = {}     # rule id -> tracked rule
+        self._trackingSince = datetime.utcnow()
+
+    def add(self, ruleId, rseSrc, rseDst, submittedAt=None):
+        """ Start tracking rule <ruleId> from <rseSrc> to <rseDst>, submitted at epoch time <submittedAt>. """
+        self.rules[ruleId] = {
+            "rule_id": ruleId,
+            "from_rse": rseSrc,
+            "to_rse": rseDst,
+            "submitted_at": submittedAt if submittedAt is not None else time.time(),
+            "final_state": None,
+            "last_state": None,
+            "time_to_final_state": None,
+        }
+
+    @property
+    def pending(self):
+        """ Get the ids of rules that have not yet reached a final state. """
+        return [ruleId for ruleId, rule in self.rules.items() if rule["final_state"] is None]
+
+    def _getStates(self, ruleIds):
+        """ Get the current states of <ruleIds> as a dictionary keyed by rule id. """
+        if self.filters is not None:
+            filters = dict(self.filters)
+            # Only consider rules created since tracking started (with a margin for clock skew).
+            filters.setdefault(
+                "created_after", (self._trackingSince - timedelta(minutes=5)).strftime(RUCIO_DATE_FORMAT))
+            wanted = set(ruleIds)
+            return {rule["id"]: rule["state"] for rule in self.client.list_replication_rules(filters)
+                    if rule["id"] in wanted}
+        states = {}
+        for ruleId in ruleIds:
+            states[ruleId] = self.client.get_replication_rule(ruleId)["state"]
+        return states
+
+    def _pollRound(self):
+        """ Poll the states of all pending rules once, returning the number still pending. """
+        pending = self.pending
+        try:
+            states = self._getStates(pending)
+        except Exception as e:
+            self.logger.warning("Error polling rule states: {}".format(repr(e)))
+            return len(pending)
+
+        now = time.time()
+        for ruleId in pending:
+            rule = self.rules[ruleId]
+            state = states.get(ruleId)
+            if state is None:
+                continue
+            rule["last_state"] = state
+            if state in self.FINAL_STATES:
+                rule["final_state"] = state
+                rule["time_to_final_state"] = now - rule["submitted_at"]
+                self.logger.debug("Rule {} ({} -> {}) is {} after {}s".format(
+                    ruleId, rule["from_rse"], rule["to_rse"], state, round(rule["time_to_final_state"], 1)))
+        return len(self.pending)
+
+    def wait(self):
+        """ Poll until all rules reach a final state or the deadline passes. Unfinished rules are marked TIMEOUT. """
+        self._trackingSince = min(
+            [datetime.utcfromtimestamp(rule["submitted_at"]) for rule in self.rules.values()] + [datetime.utcnow()])
+        self.logger.info("Tracking {} rules...".format(len(self.rules)))
+        poller = Poller(
+            self.logger,
+            initialIntervalS=self.initialIntervalS,
+            maxIntervalS=self.maxIntervalS,
+            backoffFactor=self.backoffFactor,
+            deadlineS=self.deadlineS
+        )
+        poller.poll(self._pollRound, lambda nPending: nPending == 0, description="rules to reach a final state")
+
+        for ruleId in self.pending:
+            self.rules[ruleId]["final_state"] = "TIMEOUT"
+        self.logger.info("Finished tracking rules: {} OK, {} STUCK, {} TIMEOUT".format(
+            *[sum(1 for rule in self.rules.values() if rule["final_state"] == state)
+              for state in ("OK", "STUCK", "TIMEOUT")]))
+
+    def summary(self):
+        """
+        Summarise tracked rules per (source, destination) RSE pair.
+
+        Returns a list of dictionaries with rule counts by final state and time-to-OK/time-to-STUCK percentiles.
+        """
+        pairs = {}
+        for rule in self.rules.values():
+            pairs.setdefault((rule["from_rse"], rule["to_rse"]), []).append(rule)
+
+        summaries = []
+        for (rseSrc, rseDst), rules in sorted(pairs.items()):
+            summary = {
+                "from_rse": rseSrc,
+                "to_rse": rseDst,
+                "n_rules": len(rules),
+            }
+            for state in ("OK", "STUCK", "TIMEOUT"):
+                summary["n_{}".format(state.lower())] = sum(1 for rule in rules if rule["final_state"] == state)
+            for state in ("OK", "STUCK"):
+                durations = [rule["time_to_final_state"] for rule in rules if rule["final_state"] == state]
+                for key, value in calculatePercentiles(durations).items():
+                    summary["time_to_{}_{}".format(state.lower(), key)] = value
+            summaries.append(summary)
+        return summaries
@@ -1,6 +1,74 @@
+import atexit
+from datetime import datetime, timezone
+import itertools
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 
+# Queue listeners of asynchronous loggers, by logger name.
+#
+_listeners = {}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON documents.
+
+    The message is only built (and any %-style arguments substituted) when a record is formatted, i.e. once it has
+    passed the level checks, and on the listener's thread if the logger is asynchronous.
+    """
+
+    def format(self, record):
+        document = {
+            "@timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "name": record.name,
+            "module": record.module,
+            "level": record.levelname,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            document["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue records as they are, leaving all formatting to the listener's thread.
+
+    The stdlib QueueHandler formats each record before enqueuing it so that it can be pickled; records here never
+    leave the process, so that cost is avoided on the logging thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class EveryN():
+    """
+    Log only the first and every <n>th call, e.g. for per-item progress lines in hot loops:
+
+        progress = EveryN(logger, 100)
+        for idx, item in enumerate(items):
+            progress("processed %d of %d items", idx + 1, len(items))
+
+    Pass %-style arguments rather than a formatted string so that skipped calls cost only a counter increment.
+    """
+
+    def __init__(self, logger, n, level=logging.INFO):
+        self.logger = logger
+        self.n = max(1, n)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+        self._counter = itertools.count()
+
+    def __call__(self, msg, *args, **kwargs):
+        if next(self._counter) % self.n == 0 and self.logger.isEnabledFor(self.level):
+            kwargs.setdefault("stacklevel", 2)
+            self.logger.log(self.level, msg, *args, **kwargs)
+
 
 class Logger:
     def __init__(
@@ -9,15 +77,18 @@ class Logger:
         level="DEBUG",
         fmt="%(asctime)s [%(name)s] %(module)20s %(levelname)5s %(process)d\t" +
         "%(message)s",
-        add_ch=True
+        add_ch=True,
+        use_queue=False,
+        use_json=False
     ):
         self._fmt = fmt
         self._name = name
         self._level = level
+        self._useQueue = use_queue
 
         # Create Formatter object with desired logging format.
         #
-        self.formatter = logging.Formatter(self.fmt)
+        self.formatter = JSONFormatter() if use_json else logging.Formatter(self.fmt)
 
         # Logger set to capture ALL logging events, handlers then further restrict
         # this with their own levels.
@@ -35,13 +106,30 @@ class Logger:
             self._addConsoleHandler()
 
     def _clearHandlers(self):
+        listener = _listeners.pop(self.name, None)
+        if listener is not None:
+            listener.stop()
         self.get().handlers = []
 
     def _addConsoleHandler(self):
         ch = logging.StreamHandler(sys.stdout)
         ch.setLevel(self.level)
         ch.setFormatter(fmt=self.formatter)
-        self.get().addHandler(ch)
+        if not self.useQueue:
+            self.get().addHandler(ch)
+            return
+
+        # Write to stdout from a listener thread, so that logging calls only enqueue records and never block on
+        # stdout (e.g. a pipe to the container runtime). The listener is stopped, flushing any queued records, when
+        # the handlers are cleared or at exit.
+        #
+        q = queue.SimpleQueue()
+        qh = _QueueHandler(q)
+        qh.setLevel(self.level)
+        listener = logging.handlers.QueueListener(q, ch, respect_handler_level=True)
+        listener.start()
+        _listeners[self.name] = listener
+        self.get().addHandler(qh)
 
     @property
     def config(self):
@@ -66,3 +154,15 @@ class Logger:
     def name(self):
         """ Getter for logger name. """
         return self._name
+
+    @property
+    def useQueue(self):
+        """ Getter for whether records are written asynchronously. """
+        return self._useQueue
+
+
+@atexit.register
+def _stopListeners():
+    for listener in list(_listeners.values()):
+        listener.stop()
+    _listeners.clear()
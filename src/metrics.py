@@ -0,0 +1,259 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+from threading import Lock, Thread, local
+
+import requests
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _formatValue(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _formatLabels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')) for name, value in pairs) + "}"
+
+
+class _Metric():
+    """
+    Base class for metrics, identified by a name and a fixed tuple of label names.
+
+    Samples are recorded into per-thread shards, dictionaries keyed by the tuple of label values, so that recording
+    is lock-free. A shard is only registered (under a lock) the first time a thread records to the metric, and
+    shards are merged when the metric is collected.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelNames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self._local = local()
+        self._shards = []
+        self._shardsLock = Lock()
+
+    def _key(self, labels):
+        try:
+            return tuple(labels[name] for name in self.labelNames)
+        except KeyError as e:
+            raise ValueError("Missing label {} for metric {}".format(e, self.name))
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shardsLock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self):
+        """ Get a copy of each shard (dict.copy() is atomic with respect to the owning thread). """
+        with self._shardsLock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+    def samples(self):
+        """ Get the exposition lines for this metric's samples. """
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation.replace('\\', r'\\').replace('\n', r'\n')),
+            "# TYPE {} {}".format(self.name, self.TYPE),
+        ]
+        return lines + self.samples()
+
+
+class Counter(_Metric):
+    """ A monotonically increasing value, e.g. the number of bytes uploaded. """
+
+    TYPE = "counter"
+
+    def inc(self, value=1, **labels):
+        if value < 0:
+            raise ValueError("Counters can only be incremented by non-negative values")
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def values(self):
+        """ Get the merged value for each tuple of label values. """
+        totals = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def samples(self):
+        return ["{}{} {}".format(self.name, _formatLabels(self.labelNames, key), _formatValue(value))
+                for key, value in self.values().items()]
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down, e.g. whether a service is alive.
+
+    The last value set (from any thread) wins, so gauges are kept in a single dictionary rather than per-thread
+    shards; a single dictionary assignment doesn't need a lock.
+    """
+
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, labelNames=()):
+        super().__init__(name, documentation, labelNames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def values(self):
+        return self._values.copy()
+
+    def samples(self):
+        return ["{}{} {}".format(self.name, _formatLabels(self.labelNames, key), _formatValue(value))
+                for key, value in self.values().items()]
+
+
+class Histogram(_Metric):
+    """ Observations counted in cumulative buckets with upper bounds <buckets>, e.g. request latencies. """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelNames)
+        if "le" in self.labelNames:
+            raise ValueError("Histograms can't have a label named le")
+        self.buckets = tuple(sorted(buckets))
+        if not self.buckets or not math.isinf(self.buckets[-1]):
+            self.buckets += (math.inf,)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then the sum of observations.
+            state = shard[key] = [0] * len(self.buckets) + [0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def values(self):
+        """ Get the merged (per-bucket counts, sum) for each tuple of label values. """
+        merged = {}
+        for shard in self._snapshot():
+            for key, state in shard.items():
+                state = list(state)
+                total = merged.setdefault(key, [0] * len(state))
+                for idx, value in enumerate(state):
+                    total[idx] += value
+        return {key: (state[:-1], state[-1]) for key, state in merged.items()}
+
+    def samples(self):
+        lines = []
+        for key, (counts, total) in self.values().items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _formatLabels(self.labelNames, key, [("le", _formatValue(bound))]), cumulative))
+            labels = _formatLabels(self.labelNames, key)
+            lines.append("{}_sum{} {}".format(self.name, labels, _formatValue(total)))
+            lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+
+class Registry():
+    """
+    A collection of metrics that can be exposed in the Prometheus text format, either served on /metrics or pushed
+    to a Pushgateway.
+
+    Metrics are created with counter(), gauge() and histogram(), which return the existing metric if one with the
+    same name has already been registered, so modules can declare the metrics they record at import time.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _register(self, cls, name, documentation, labelNames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelNames, **kwargs)
+            elif type(metric) is not cls or metric.labelNames != tuple(labelNames):
+                raise ValueError("Metric {} is already registered as a {} with labels {}".format(
+                    name, metric.TYPE, metric.labelNames))
+        return metric
+
+    def counter(self, name, documentation, labelNames=()):
+        return self._register(Counter, name, documentation, labelNames)
+
+    def gauge(self, name, documentation, labelNames=()):
+        return self._register(Gauge, name, documentation, labelNames)
+
+    def histogram(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelNames, buckets=buckets)
+
+    def expose(self):
+        """ Get all metrics in the Prometheus text exposition format. """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.expose()
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, address=""):
+        """
+        Serve metrics on http://<address>:<port>/metrics from a background thread.
+
+        Returns the server, which can be stopped with shutdown().
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.expose().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def push(self, url, job, grouping=None, timeoutS=10):
+        """
+        Push all metrics to a Pushgateway at <url>, replacing the metrics in the group identified by <job> and the
+        <grouping> labels.
+        """
+        path = "/metrics/job/{}".format(requests.utils.quote(job, safe=''))
+        for name, value in (grouping or {}).items():
+            path += "/{}/{}".format(name, requests.utils.quote(str(value), safe=''))
+        response = requests.put(url.rstrip('/') + path, data=self.expose().encode(),
+                                headers={"Content-Type": CONTENT_TYPE}, timeout=timeoutS)
+        response.raise_for_status()
+
+
+# The default registry, used by tasks to record metrics and by run.py to expose them.
+#
+REGISTRY = Registry()
@@ -0,0 +1,135 @@
+import cProfile
+from datetime import datetime
+import io
+import os
+import pstats
+import tracemalloc
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+class Profiler():
+    """
+    Profile a block of code, e.g. a task's run method, logging a summary when it ends.
+
+    Modes are:
+    - cprofile: deterministic profiling with cProfile, logging the top <topN> functions by cumulative time,
+    - pyinstrument: statistical profiling with pyinstrument if it is installed (falls back to cprofile otherwise),
+    - tracemalloc: memory profiling, logging the peak traced memory and the top <topN> allocation sites.
+
+    If <outputDir> is set, the raw profile (a pstats file, pyinstrument HTML report or tracemalloc snapshot) is
+    also written there, named after <name> and the time profiling started.
+    """
+
+    MODES = ('cprofile', 'pyinstrument', 'tracemalloc')
+
+    def __init__(self, logger, mode="cprofile", name="task", outputDir=None, topN=20, nFrames=10):
+        if mode not in self.MODES:
+            raise ValueError("Unknown profiling mode {}, expected one of {}".format(mode, " || ".join(self.MODES)))
+        if mode == "pyinstrument" and pyinstrument is None:
+            logger.warning("pyinstrument is not installed, falling back to cprofile")
+            mode = "cprofile"
+        self.logger = logger
+        self.mode = mode
+        self.name = name
+        self.outputDir = outputDir
+        self.topN = topN
+        self.nFrames = nFrames
+
+        self._profiler = None
+        self._startedAt = None
+
+    @classmethod
+    def fromConfig(cls, logger, config, name="task", outputDir=None):
+        """
+        Construct a profiler from a task's profile option: true (for cprofile), a mode, or a dictionary with keys
+        mode, top_n, n_frames (tracemalloc only) and output_dir. <outputDir>, if set, takes precedence over
+        output_dir.
+        """
+        if config is True:
+            config = {}
+        elif isinstance(config, str):
+            config = {"mode": config}
+        elif not isinstance(config, dict):
+            raise ValueError("Profile option must be true, a mode or a dictionary, got {}".format(repr(config)))
+        return cls(
+            logger,
+            mode=config.get("mode", "cprofile"),
+            name=name,
+            outputDir=outputDir or config.get("output_dir"),
+            topN=config.get("top_n", 20),
+            nFrames=config.get("n_frames", 10)
+        )
+
+    def _outputPath(self, extension):
+        os.makedirs(self.outputDir, exist_ok=True)
+        return os.path.join(self.outputDir, "{}_{}.{}".format(
+            self.name, self._startedAt.strftime("%d%m%yT%H.%M.%S"), extension))
+
+    def start(self):
+        self._startedAt = datetime.now()
+        self.logger.info("Profiling with {}...".format(self.mode))
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.mode == "pyinstrument":
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        else:
+            tracemalloc.start(self.nFrames)
+
+    def stop(self):
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            self._reportCProfile()
+        elif self.mode == "pyinstrument":
+            self._profiler.stop()
+            self._reportPyinstrument()
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._reportTracemalloc(snapshot, current, peak)
+
+    def _reportCProfile(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.topN)
+        self.logger.info("Top {} functions by cumulative time:\n{}".format(self.topN, stream.getvalue()))
+        if self.outputDir:
+            path = self._outputPath("prof")
+            stats.dump_stats(path)
+            self.logger.info("Wrote profile to {}".format(path))
+
+    def _reportPyinstrument(self):
+        self.logger.info("Profile:\n{}".format(self._profiler.output_text()))
+        if self.outputDir:
+            path = self._outputPath("html")
+            with open(path, 'w') as f:
+                f.write(self._profiler.output_html())
+            self.logger.info("Wrote profile to {}".format(path))
+
+    def _reportTracemalloc(self, snapshot, current, peak):
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        lines = ["{}: {} KiB in {} blocks".format(stat.traceback[0], round(stat.size / 1024, 1), stat.count)
+                 for stat in snapshot.statistics("lineno")[:self.topN]]
+        self.logger.info("Peak traced memory: {} MiB (current {} MiB)".format(
+            round(peak / 1024 ** 2, 1), round(current / 1024 ** 2, 1)))
+        self.logger.info("Top {} allocation sites:\n{}".format(self.topN, "\n".join(lines)))
+        if self.outputDir:
+            path = self._outputPath("tracemalloc")
+            snapshot.dump(path)
+            self.logger.info("Wrote snapshot to {}".format(path))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -1,12 +1,17 @@
 #!/usr/bin/python3
 from __future__ import absolute_import
 
+from common.es import pushToDatabases
 from session import Session
 from logger import Logger
+from metrics import REGISTRY
+from profiler import Profiler
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import argparse
+from datetime import datetime
 import requests
 import importlib
+import time
 import urllib3
 import warnings
 
@@ -21,6 +26,20 @@ if __name__ == "__main__":
                         default="../etc/tasks/stubs.yml",
                         type=str)
     parser.add_argument('-v', help="verbose?", action='store_true')
+    parser.add_argument('--profile', help="profile every task (overrides each task's profile option)",
+                        choices=Profiler.MODES, default=None, type=str)
+    parser.add_argument('--profile-dir', help="directory to write raw profiles to",
+                        default=None, type=str)
+    parser.add_argument('--async-logging', help="write logs from a background thread",
+                        action='store_true')
+    parser.add_argument('--json-logs', help="format logs as JSON",
+                        action='store_true')
+    parser.add_argument('--metrics-port', help="serve metrics on http://0.0.0.0:<port>/metrics while running",
+                        default=None, type=int)
+    parser.add_argument('--metrics-push-url', help="Pushgateway to push metrics to after each task",
+                        default=None, type=str)
+    parser.add_argument('--metrics-job', help="job name to push metrics under",
+                        default="rucio-task-manager", type=str)
     iargs = parser.parse_args()
 
     # Setup default root loggers for CRITICAL warnings.
@@ -28,7 +47,14 @@ if __name__ == "__main__":
     # These will be overriden by per-task loggers, but provide a failsafe
     # if exceptions occur while instantiating these tasks.
     #
-    logger = Logger(name='root', level='INFO').get()
+    logger = Logger(name='root', level='INFO', use_queue=iargs.async_logging, use_json=iargs.json_logs).get()
+
+    taskDuration = REGISTRY.histogram("task_duration_seconds", "Duration of task runs.", ("task", "class_name"))
+    taskRuns = REGISTRY.counter("task_runs_total", "Number of task runs by outcome.", ("task", "class_name", "outcome"))
+    taskLastRun = REGISTRY.gauge("task_last_run_timestamp_seconds", "Time the task last finished.", ("task",))
+    if iargs.metrics_port is not None:
+        REGISTRY.serve(iargs.metrics_port)
+        logger.info("Serving metrics on port {}".format(iargs.metrics_port))
 
     session = Session(tasks=iargs.t, logger=logger)
     for task in session.tasks:
@@ -39,14 +65,13 @@ if __name__ == "__main__":
             enabled = session.tasks[task]['enabled']
             args = session.tasks[task]['args']
             kwargs = session.tasks[task]['kwargs']
+            profile = iargs.profile or session.tasks[task].get('profile')
             kwargs['task_name'] = task
 
             # Remove root logger and create new logger per task.
             #
-            if iargs.v:
-                logger = Logger(name='{}'.format(class_name), level='DEBUG').get()
-            else:
-                logger = Logger(name='{}'.format(class_name), level='INFO').get()
+            logger = Logger(name='{}'.format(class_name), level='DEBUG' if iargs.v else 'INFO',
+                            use_queue=iargs.async_logging, use_json=iargs.json_logs).get()
 
             if not enabled:
                 logger.warning("Task is not enabled!")
@@ -67,9 +92,49 @@ if __name__ == "__main__":
                 logger.critical(repr(e))
                 exit()
 
-            # Begin task with <args> and <kwargs> as input parameters.
+            # Begin task with <args> and <kwargs> as input parameters, profiling it if requested.
+            #
+            startedAt = time.perf_counter()
+            if profile:
+                try:
+                    profiler = Profiler.fromConfig(
+                        logger, profile, name=kwargs['task_name'], outputDir=iargs.profile_dir)
+                except ValueError as e:
+                    logger.critical("Invalid profile option, skipping task.")
+                    logger.critical(repr(e))
+                    continue
+                with profiler:
+                    result = task.run(args, kwargs)
+            else:
+                result = task.run(args, kwargs)
+
+            # Record the run's outcome, pushing all metrics if a Pushgateway is configured.
+            #
+            taskDuration.observe(time.perf_counter() - startedAt, task=kwargs['task_name'], class_name=class_name)
+            taskRuns.inc(task=kwargs['task_name'], class_name=class_name,
+                         outcome="failed" if result is False else "completed")
+            taskLastRun.set(time.time(), task=kwargs['task_name'])
+            if iargs.metrics_push_url:
+                try:
+                    REGISTRY.push(iargs.metrics_push_url, iargs.metrics_job)
+                except Exception as e:
+                    logger.warning("Could not push metrics: {}".format(repr(e)))
+
+            # Log a summary of any timed spans, and send it to the task's span databases if requested. These are
+            # kept separate from the task's output databases, as the documents have a different shape.
             #
-            task.run(args, kwargs)
+            spanSummary = task.spanSummary()
+            for entry in spanSummary:
+                logger.info("Span {} {}: count {}, total {}s, p50 {}s, max {}s".format(
+                    entry["span"], entry["attributes"], entry["count"], round(entry["sum_s"], 3),
+                    round(entry["p50_s"], 3), round(entry["max_s"], 3)))
+                entry.update({
+                    "@timestamp": datetime.now().isoformat(),
+                    "task_name": kwargs['task_name'],
+                    "type": "span_summary",
+                })
+            if spanSummary:
+                pushToDatabases(logger.name, (kwargs.get("output") or {}).get("span_databases"), spanSummary)
         except KeyError as e:
             logger.critical("Required key not found in config.")
             logger.critical(repr(e))
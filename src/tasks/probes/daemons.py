@@ -1,16 +1,21 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-import dateparser
+import time
 from kubernetes import client, config
-import uuid
-
-from elasticsearch import Elasticsearch
 
+from common.es import pushToDatabases
+from common.probes.daemon_logs import DaemonLogParser
+from common.probes.daemon_watch import DaemonWatcher
 from tasks.task import Task
 
 
 class ProbesDaemons(Task):
-    """ Get information for daemons. """
+    """
+    Get information for daemons.
+
+    Pods are listed with a single (optionally label-selected) request, and the status in the list response is used
+    directly. The last log line of each daemon pod is then fetched concurrently.
+    """
 
     def __init__(self, logger):
         super().__init__(logger)
@@ -19,8 +24,42 @@ class ProbesDaemons(Task):
         self.clusterServiceAccountToken = None
         self.daemonLikeNames = None
         self.namespace = None
+        self.kubeConfigPath = None
+        self.labelSelector = None
+        self.logThreads = None
+        self.logParser = DaemonLogParser()
         self.outputDatabases = None
 
+    def _getLastLog(self, v1, pod, likeName):
+        """ Get the time and message of the last log line of <pod>, or (None, None) if it can't be read or parsed. """
+        try:
+            log = v1.read_namespaced_pod_log(namespace=self.namespace, name=pod.metadata.name, tail_lines=1)
+        except Exception as e:
+            self.logger.warning("Could not get last log line for pod {}: {}".format(pod.metadata.name, repr(e)))
+            return None, None
+        return self.logParser.parse(likeName, log)
+
+    def _getCoreV1Api(self):
+        """ Get a kubernetes CoreV1Api for the cluster. """
+        config.load_kube_config(config_file=self.kubeConfigPath)
+        return client.CoreV1Api()
+
+    def _podEntry(self, pod, likeName, logDate, logMessage, timestamp):
+        now = datetime.datetime.utcnow()
+        startTime = pod.status.start_time
+        return {
+            '@timestamp': timestamp,
+            'pod_name': pod.metadata.name,
+            'daemon_like_name': likeName,
+            'pod_phase': pod.status.phase,
+            'pod_phase_bool': 1 if pod.status.phase == 'Running' else 0,
+            'pod_start_time': startTime,
+            'pod_uptime': (now - startTime.replace(tzinfo=None)).total_seconds() if startTime else None,
+            'last_log_time_UTC': logDate,
+            'last_log_message': logMessage,
+            'seconds_since_last_message': (now - logDate).total_seconds() if logDate else None
+        }
+
     def run(self, args, kwargs):
         super().run()
         self.tic()
@@ -31,6 +70,9 @@ class ProbesDaemons(Task):
             self.clusterServiceAccountToken = kwargs["cluster_service_account_token"]
             self.daemonLikeNames = kwargs["daemon_like_names"]
             self.namespace = kwargs['namespace']
+            self.kubeConfigPath = kwargs.get("kube_config_path")
+            self.labelSelector = kwargs.get("label_selector")
+            self.logThreads = kwargs.get("log_threads", 16)
             self.outputDatabases = kwargs["output"]["databases"]
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
@@ -39,44 +81,114 @@ class ProbesDaemons(Task):
 
         #FIXME
         #https://github.com/kubernetes-client/python/blob/master/examples/remote_cluster.py
-        config.load_kube_config(config_file=kubeConfigPath)
-        v1 = client.CoreV1Api()
+        v1 = self._getCoreV1Api()
 
-        pods = v1.list_namespaced_pod(namespace=self.namespace)
+        # List pods once, narrowing server-side by label if a selector is given. The pod status is included in the
+        # list response.
+        #
+        if self.labelSelector:
+            pods = v1.list_namespaced_pod(namespace=self.namespace, label_selector=self.labelSelector)
+        else:
+            pods = v1.list_namespaced_pod(namespace=self.namespace)
+        daemonPods = []
         for pod in pods.items:
-            if any(likeName in pod.metadata.name for likeName in self.daemonLikeNames):
-                likeName = next((likeName for likeName in self.daemonLikeNames if likeName in pod.metadata.name), None)
-
-                status = v1.read_namespaced_pod_status(namespace=self.namespace, name=pod.metadata.name)
-
-                log = v1.read_namespaced_pod_log(namespace=self.namespace, name=pod.metadata.name, tail_lines=1)
-                logDate = dateparser.parse(log.split('\t')[0].strip().replace(',', '.'), settings={'TIMEZONE': 'UTC'})
-                logMessage = log.split('\t')[4].strip()
-
-                # Push task output to databases.
-                #
-                if self.outputDatabases is not None:
-                    for database in self.outputDatabases:
-                        if database["type"] == "es":
-                            self.logger.info("Sending output to ES database...")
-                            auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                            es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                            es.index(
-                                index=database["index"],
-                                id=str(uuid.uuid4()),
-                                body={
-                                    '@timestamp': int(datetime.datetime.now().strftime("%s"))*1000,
-                                    'pod_name': pod.metadata.name,
-                                    'daemon_like_name': likeName,
-                                    'pod_phase': status.status.phase,
-                                    'pod_phase_bool': 1 if status.status.phase == 'Running' else 0,
-                                    'pod_start_time': status.status.start_time,
-                                    'pod_uptime': (datetime.datetime.utcnow()-status.status.start_time.replace(tzinfo=None)).total_seconds(),
-                                    'last_log_time_UTC': logDate,
-                                    'last_log_message': logMessage,
-                                    'seconds_since_last_message': (datetime.datetime.utcnow()-logDate).total_seconds()
-                                }
-                            )
+            likeName = next((likeName for likeName in self.daemonLikeNames if likeName in pod.metadata.name), None)
+            if likeName is not None:
+                daemonPods.append((pod, likeName))
+        self.logger.info("Found {} daemon pods of {} listed".format(len(daemonPods), len(pods.items)))
+
+        # Fetch the last log line of each daemon pod concurrently.
+        #
+        with ThreadPoolExecutor(max_workers=self.logThreads) as executor:
+            logs = list(executor.map(lambda daemonPod: self._getLastLog(v1, *daemonPod), daemonPods))
+
+        timestamp = int(datetime.datetime.now().strftime("%s"))*1000
+        entries = [self._podEntry(pod, likeName, logDate, logMessage, timestamp)
+                   for (pod, likeName), (logDate, logMessage) in zip(daemonPods, logs)]
+
+        # Push task output to databases.
+        #
+        pushToDatabases(self.logger.name, self.outputDatabases, entries)
+
+        self.toc()
+        self.logger.info("Finished in {}s".format(round(self.elapsed)))
+
+
+class ProbesDaemonsWatch(ProbesDaemons):
+    """
+    Watch daemons continuously.
+
+    Pods in the namespace and the logs of running daemon pods are followed with kubernetes watch streams, and a
+    summary of each daemon pod (phase, restarts, time since last log message and whether it is stalled) is sent to
+    the output databases every <flush_interval_s>. Runs for <duration_s>, or until interrupted if not set.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger)
+        self.flushIntervalS = None
+        self.stallThresholdS = None
+        self.durationS = None
+        self.logTailLines = None
+        self.v1 = None          # a CoreV1Api to use instead of loading the kube config, e.g. a fake API server
+
+    def _flush(self, watcher):
+        timestamp = int(datetime.datetime.now().strftime("%s"))*1000
+        entries = watcher.snapshot(stallThresholdS=self.stallThresholdS)
+        for entry in entries:
+            entry['@timestamp'] = timestamp
+            if entry['is_stalled']:
+                self.logger.warning("Daemon pod {} has not logged for {}s".format(
+                    entry['pod_name'], round(entry['seconds_since_last_message'] or entry['pod_uptime'])))
+        pushToDatabases(self.logger.name, self.outputDatabases, entries)
+
+    def run(self, args, kwargs):
+        Task.run(self)
+        self.tic()
+
+        try:
+            self.daemonLikeNames = kwargs["daemon_like_names"]
+            self.namespace = kwargs['namespace']
+            self.kubeConfigPath = kwargs.get("kube_config_path")
+            self.labelSelector = kwargs.get("label_selector")
+            self.flushIntervalS = kwargs.get("flush_interval_s", 60)
+            self.stallThresholdS = kwargs.get("stall_threshold_s", 600)
+            self.durationS = kwargs.get("duration_s")
+            self.logTailLines = kwargs.get("log_tail_lines", 1)
+            self.outputDatabases = kwargs["output"]["databases"]
+        except KeyError as e:
+            self.logger.critical("Could not find necessary kwarg for task.")
+            self.logger.critical(repr(e))
+            return False
+
+        watcher = DaemonWatcher(
+            self.logger,
+            self.v1 if self.v1 is not None else self._getCoreV1Api(),
+            self.namespace,
+            self.daemonLikeNames,
+            self.logParser.parse,
+            labelSelector=self.labelSelector,
+            logTailLines=self.logTailLines
+        )
+        watcher.start()
+        # Flush every <flushIntervalS>, sleeping only for what remains of <durationS> at the end. The last window is
+        # flushed once, after the loop, however it ends.
+        #
+        try:
+            while True:
+                intervalS = self.flushIntervalS
+                if self.durationS is not None:
+                    intervalS = min(intervalS, self.durationS - self.elapsed)
+                    if intervalS <= 0:
+                        break
+                time.sleep(intervalS)
+                if self.durationS is not None and self.elapsed >= self.durationS:
+                    break
+                self._flush(watcher)
+        except KeyboardInterrupt:
+            self.logger.info("Interrupted, stopping...")
+        finally:
+            watcher.stop()
+        self._flush(watcher)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -1,13 +1,18 @@
-import os
 from datetime import datetime
-import dateparser
-import json
-import requests
-import uuid
-
-from elasticsearch import Elasticsearch
+import re
 
+from common.es import pushToDatabases
+from common.probes.heartbeat import DEFAULT_CONNECT_TIMEOUT_S, DEFAULT_READ_TIMEOUT_S, DEFAULT_TOTAL_TIMEOUT_S, \
+    probeServices
+from common.probes.histogram import LatencyHistograms
+from common.probes.validators import ContentValidator
+from metrics import REGISTRY
 from tasks.task import Task
+from utility import calculatePercentiles
+
+SERVICE_UP = REGISTRY.gauge("service_up", "Whether the service was alive when last probed.", ("service",))
+SERVICE_LATENCY = REGISTRY.histogram("service_heartbeat_latency_seconds", "Latency of service heartbeat requests.",
+                                     ("service",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
 
 
 class ProbesServiceHeartbeats(Task):
@@ -16,61 +21,121 @@ class ProbesServiceHeartbeats(Task):
     def __init__(self, logger):
         super().__init__(logger)
         self.services = None
+        self.connectTimeoutS = None
+        self.readTimeoutS = None
+        self.totalTimeoutS = None
+        self.nSamples = None
+        self.sampleWindowS = None
+        self.aliveThreshold = None
+        self.histogram = None
         self.outputDatabases = None
 
+    def _check(self, svc, response):
+        """ Check a response against a service's expectations, returning an error message or None. """
+        if response['error'] is not None:
+            return 'request failed: {}'.format(response['error'])
+        if response['status_code'] != svc['expected_status_code']:
+            return 'status code mismatch, expected {} got {}'.format(
+                svc['expected_status_code'], response['status_code']
+            )
+        return response['content_error']
+
     def run(self, args, kwargs):
         super().run()
         self.tic()
 
         try:
             self.services = kwargs["services"]
+            self.connectTimeoutS = kwargs.get("connect_timeout_s", DEFAULT_CONNECT_TIMEOUT_S)
+            self.readTimeoutS = kwargs.get("read_timeout_s", DEFAULT_READ_TIMEOUT_S)
+            self.totalTimeoutS = kwargs.get("total_timeout_s", DEFAULT_TOTAL_TIMEOUT_S)
+            self.nSamples = kwargs.get("n_samples", 1)
+            self.sampleWindowS = kwargs.get("sample_window_s", 0)
+            self.aliveThreshold = kwargs.get("alive_threshold", 0.5)
+            self.histogram = kwargs.get("histogram")
             self.outputDatabases = kwargs["output"]["databases"]
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
             return False
+        if self.nSamples < 1:
+            self.logger.critical("n_samples must be at least 1, got {}.".format(self.nSamples))
+            return False
+        if not 0 < self.aliveThreshold <= 1:
+            self.logger.critical("alive_threshold must be in (0, 1], got {}.".format(self.aliveThreshold))
+            return False
+
+        # Compile content checks once per service.
+        #
+        try:
+            validators = [ContentValidator.fromService(svc) for svc in self.services]
+        except (ValueError, re.error) as e:
+            self.logger.critical("Invalid content check for service.")
+            self.logger.critical(repr(e))
+            return False
+
+        histograms = None
+        if self.histogram:
+            histograms = LatencyHistograms(self.histogram["path"], maxRuns=self.histogram.get("max_runs", 96))
+
+        # Probe all services concurrently, so the probe takes as long as the slowest service (capped by its
+        # timeout) plus the sample window.
+        #
+        probedAt = datetime.now().isoformat()
+        samples = probeServices(self.services, connectTimeoutS=self.connectTimeoutS, readTimeoutS=self.readTimeoutS,
+                                totalTimeoutS=self.totalTimeoutS, nSamples=self.nSamples, windowS=self.sampleWindowS,
+                                validators=validators)
+
+        entries = []
+        for svc, responses in zip(self.services, samples):
+            errors = [self._check(svc, response) for response in responses]
+            latencies = [response['latency_s'] for response in responses if response['latency_s'] is not None]
+            ttfbs = [response['ttfb_s'] for response in responses if response['ttfb_s'] is not None]
+            nSucceeded = sum(1 for error in errors if error is None)
+
+            # A service is alive if enough samples succeed, so that one-off blips are not reported as outages.
+            svc['success_fraction'] = nSucceeded / len(responses)
+            svc['is_alive'] = 1 if svc['success_fraction'] >= self.aliveThreshold and nSucceeded > 0 else 0
+            svc['error'] = None if svc['is_alive'] else next(error for error in errors if error is not None)
+
+            SERVICE_UP.set(svc['is_alive'], service=svc['name'])
+            for latency in latencies:
+                SERVICE_LATENCY.observe(latency, service=svc['name'])
+
+            latencyPercentiles = calculatePercentiles(latencies, percentiles=(50, 95))
+            svc['ttfb_s'] = calculatePercentiles(ttfbs, percentiles=(50,))['p50']
+            svc['latency_s'] = latencyPercentiles['p50']
+            self.logger.debug("Service {} is_alive: {}, success fraction: {}, latency: {}s".format(
+                svc['name'], svc['is_alive'], svc['success_fraction'], svc['latency_s']))
+
+            entry = {
+                '@timestamp': probedAt,
+                'service_name': svc['name'],
+                'service_endpoint': svc['endpoint'],
+                'is_alive': svc['is_alive'],
+                'error': svc['error'],
+                'ttfb_s': svc['ttfb_s'],
+                'latency_s': svc['latency_s'],
+                'n_samples': len(responses),
+                'success_fraction': svc['success_fraction'],
+                'latency_min_s': min(latencies) if latencies else None,
+                'latency_p50_s': latencyPercentiles['p50'],
+                'latency_p95_s': latencyPercentiles['p95'],
+                'latency_max_s': latencyPercentiles['max'],
+            }
+            if histograms is not None:
+                for latency in latencies:
+                    histograms.record(svc['name'], latency)
+                for key, value in histograms.percentiles(svc['name']).items():
+                    entry['rolling_latency_{}_s'.format(key)] = value
+            entries.append(entry)
 
-        for svc in self.services:
-            response = requests.get(svc['endpoint'], verify=False)
-            if response.status_code == svc['expected_status_code']:
-                if svc['expected_content']:
-                    if dict(json.loads(response.content)) == svc['expected_content']:
-                        svc['is_alive'] = 1
-                        svc['error'] = None
-                    else:
-                        svc['is_alive'] = 0
-                        svc['error'] = 'content mismatch, expected {} got {}'.format(
-                            repr(svc['expected_content']), repr(dict(json.loads(response.content)))
-                        )
-                else:
-                    svc['is_alive'] = 1
-                    svc['error'] = None
-            else:
-                svc['is_alive'] = 0
-                svc['error'] = 'status code mismatch, expected {} got {}'.format(
-                    svc['expected_status_code'], response.status_code
-                )
+        if histograms is not None:
+            histograms.save()
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database...")
-                    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                    es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                    for svc in self.services:
-                        es.index(
-                            index=database["index"],
-                            id=str(uuid.uuid4()),
-                            body={
-                                '@timestamp': datetime.now().isoformat(),
-                                'service_name': svc['name'],
-                                'service_endpoint': svc['endpoint'],
-                                'is_alive': svc['is_alive'],
-                                'error': svc['error'],
-                            }
-                        )
+        pushToDatabases(self.logger.name, self.outputDatabases, entries)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
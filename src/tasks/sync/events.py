@@ -11,8 +11,13 @@ from elasticsearch import Elasticsearch, helpers
 import fts3.rest.client as fts3
 import numpy as np
 
+from logger import EveryN
+from metrics import REGISTRY
 from tasks.task import Task
 
+TRANSFERS_AGGREGATED = REGISTRY.counter("transfers_aggregated_total", "Number of transfers aggregated from events.",
+                                        ("scope", "last_event_type"))
+
 
 class SyncAndAggregateRucioTransferEvents(Task):
     """ Synchronise and aggregate Rucio transfer events. """
@@ -26,6 +31,7 @@ class SyncAndAggregateRucioTransferEvents(Task):
         self.ftsAccessTokenEnvvar = None
         self.maxNumberOfConcurrentThreads = None
         self.waitPerChunkMs = None
+        self.logEveryNChunks = None
         self.esUri = None
         self.esIndex = None
         self.esScroll = None
@@ -92,6 +98,7 @@ class SyncAndAggregateRucioTransferEvents(Task):
             self.ftsAccessTokenEnvvar = kwargs['fts']['access_token_envvar']
             self.maxNumberOfConcurrentThreads = kwargs['fts']['max_number_of_concurrent_threads']
             self.waitPerChunkMs = kwargs['fts']['wait_per_chunk_ms']
+            self.logEveryNChunks = kwargs['fts'].get('log_every_n_chunks', 1)
             self.esUri = kwargs['es']['uri']
             self.esIndex = kwargs['es']['index']
             self.esScroll = kwargs['es']['scroll']
@@ -164,7 +171,9 @@ class SyncAndAggregateRucioTransferEvents(Task):
         aggregatedTransfers = []
         self.logger.info("Aggregating to transfer groups")
         for requestId, transferGroups in groupby(sorted(docs, key=key_func), key_func):
-            aggregatedTransfers.append(self.aggregateEntries(transferGroups))
+            aggregatedTransfer = self.aggregateEntries(transferGroups)
+            TRANSFERS_AGGREGATED.inc(scope=self.scope, last_event_type=aggregatedTransfer['last_event_type'])
+            aggregatedTransfers.append(aggregatedTransfer)
         self.logger.info("Aggregated to {} transfers".format(len(aggregatedTransfers)))
 
         # Add FTS information, if requested.
@@ -173,6 +182,7 @@ class SyncAndAggregateRucioTransferEvents(Task):
             ftsContext = fts3.Context(self.ftsEndpoint, fts_access_token=access_token)       # TODO: only OIDC
 
             self.logger.info("Threading requests to FTS for aggregated transfers")
+            progress = EveryN(self.logger, self.logEveryNChunks)
             for threadIdx in range(0, len(aggregatedTransfers), self.maxNumberOfConcurrentThreads):
                 # do it in chunks so as to not throttle FTS
                 threads = []
@@ -185,7 +195,7 @@ class SyncAndAggregateRucioTransferEvents(Task):
                     threads.append(t)
                 for thread in threads:
                     thread.join()
-                self.logger.info("- processed {} transfers".format(threadIdx + chunkIdx + 1))
+                progress("- processed %d transfers", threadIdx + len(threads))
                 time.sleep(self.waitPerChunkMs / 1000.)
 
         # Push task output to databases.
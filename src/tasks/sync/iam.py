@@ -4,13 +4,16 @@ import os
 import requests
 import uuid
 
-from elasticsearch import Elasticsearch
 from rucio.client.client import Client
 from rucio.common.exception import AccountNotFound, Duplicate, RucioException, InvalidObject
 from rucio.common.schema import validate_schema
 
+from common.es import pushToDatabases
+from metrics import REGISTRY
 from tasks.task import Task
 
+IAM_CHANGES = REGISTRY.counter("iam_changes_total", "Number of IAM -> Rucio changes by type.", ("type", "dry_run"))
+
 
 class SyncIndigoIAMRucio(Task):
     """ Sync users of an Indigo IAM instance to Rucio. """
@@ -56,7 +59,9 @@ class SyncIndigoIAMRucio(Task):
 
     def _add_event(self, event_type, account, account_type=None, reason=None, account_attribute=None,
                    account_limit=None, identity=None, auth_type=None):
+        IAM_CHANGES.inc(type=event_type, dry_run=str(bool(self.dry_run)).lower())
         self.events.append({
+            "event_id": str(uuid.uuid4()),
             "created_at": datetime.now().isoformat(),
             "type": event_type,
             "account": account,
@@ -553,14 +558,7 @@ class SyncIndigoIAMRucio(Task):
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database...")
-                    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                    es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                    for event in self.events:
-                        es.index(index=database["index"], id=str(uuid.uuid4()), body=event)
+        pushToDatabases(self.logger.name, self.outputDatabases, self.events, idKey="event_id")
 
         self.toc()
         self.logger.info("Finished in {}s".format(
@@ -1,7 +1,29 @@
 import abc
+from contextlib import contextmanager
 import inspect
+from threading import Lock, local
 import time
 
+from utility import calculatePercentiles
+
+
+class Span():
+    """ A timed phase of a task, identified by its path of nested span names and its attributes. """
+
+    __slots__ = ('name', 'path', 'attrs', 'startNs', 'endNs')
+
+    def __init__(self, name, path, attrs):
+        self.name = name
+        self.path = path
+        self.attrs = attrs
+        self.startNs = time.perf_counter_ns()
+        self.endNs = None
+
+    @property
+    def duration(self):
+        """ Get the duration of the span in seconds. """
+        return ((self.endNs or time.perf_counter_ns()) - self.startNs) / 1e9
+
 
 class Task():
     """ Base class for all tasks. """
@@ -10,6 +32,9 @@ class Task():
         self.logger = logger
         self.start = None
         self.end = None
+        self.spans = []
+        self._spansLock = Lock()
+        self._spanStack = local()
 
         self.logger.debug("Constructing instance of {}()".format(
             type(self).__name__))
@@ -37,3 +62,57 @@ class Task():
             return round(time.time() - self.start, 3)
         else:
             return round(self.end - self.start, 3)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Time a phase of the task, e.g. with self.span("upload", rse=rse): ...
+
+        Spans opened within another span (on the same thread) are nested, and are identified by the path of span
+        names from the outermost, e.g. "replicate/upload". Attributes can also be added to the yielded span before
+        it ends. Spans ended by an exception are given the attribute failed=True.
+        """
+        stack = getattr(self._spanStack, "spans", None)
+        if stack is None:
+            stack = self._spanStack.spans = []
+        path = "/".join([span.name for span in stack] + [name])
+        span = Span(name, path, attrs)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException:
+            span.attrs["failed"] = True
+            raise
+        finally:
+            span.endNs = time.perf_counter_ns()
+            stack.pop()
+            with self._spansLock:
+                self.spans.append(span)
+
+    def spanSummary(self):
+        """
+        Aggregate finished spans by path and attributes.
+
+        Returns a list of dictionaries with the span path, attributes, count, and total, min, max and percentile
+        durations in seconds, ordered by when each path was first finished.
+        """
+        with self._spansLock:
+            spans = list(self.spans)
+        groups = {}
+        for span in spans:
+            key = (span.path, tuple(sorted((k, str(v)) for k, v in span.attrs.items())))
+            groups.setdefault(key, []).append(span.duration)
+
+        summary = []
+        for (path, attrs), durations in groups.items():
+            entry = {
+                "span": path,
+                "attributes": dict(attrs),
+                "count": len(durations),
+                "sum_s": sum(durations),
+                "min_s": min(durations),
+            }
+            for key, value in calculatePercentiles(durations).items():
+                entry["{}_s".format(key)] = value
+            summary.append(entry)
+        return summary
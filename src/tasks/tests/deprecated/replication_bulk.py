@@ -1,3 +1,4 @@
+from datetime import datetime
 import logging
 from multiprocessing import Pool
 import os
@@ -6,7 +7,7 @@ import time
 import uuid
 
 from common.es.rucio import Rucio as ESRucio
-from common.rucio.helpers import createCollection
+from common.rucio.helpers import createCollection, createCollections
 from common.rucio.wrappers import RucioWrappersCLI
 from tasks.task import Task
 from utility import bcolors, generateRandomFilesDir
@@ -23,6 +24,7 @@ def uploadDirReplicate(
     scope,
     lifetime,
     parentDID,
+    datasetDID,
     dirIdx=1,
     nDirs=1,
     namingPrefix="",
@@ -30,6 +32,9 @@ def uploadDirReplicate(
     """
     Upload a dir containing <nFiles> of <fileSize> to <rseSrc>, attaching
     to <datasetDID> and adding replication rules for each of <rsesDst>.
+
+    <datasetDID> is created beforehand, along with the datasets of all other
+    directories, by the parent process.
     """
     logger = logging.getLogger(loggerName)
     logger.debug("Uploading directory {} of {}".format(dirIdx, nDirs))
@@ -46,11 +51,6 @@ def uploadDirReplicate(
         nFiles, fileSize, dirId=dirIdx, prefix=namingPrefix
     )
 
-    # Create dataset DID based on directory name.
-    #
-    datasetName = os.path.basename(dirPath)
-    datasetDID = createCollection(loggerName, scope, name=datasetName)
-
     # Attach directory dataset to parent container DID.
     #
     logger.debug("Attaching DID {} to {}".format(datasetDID, parentDID))
@@ -75,7 +75,7 @@ def uploadDirReplicate(
             "type": "dataset",
             "to_rse": rseSrc,
             "scope": scope,
-            "name": os.path.basename(dirPath),
+            "name": datasetDID.split(":", 1)[1],
             "is_upload_submitted": 1,
         }
         try:
@@ -193,9 +193,18 @@ class TestReplicationBulk(Task):
             parentDID = createCollection(
                 loggerName, scope, name=containerName, collectionType="CONTAINER")
 
+        # Create the dataset DIDs for all directories with a single request, named as generateRandomFilesDir names
+        # the directories.
+        #
+        prefix = namingPrefix + "_" if namingPrefix else ""
+        todaysDatetime = datetime.now().strftime("%d%m%yT%H.%M.%S")
+        datasetNames = ["{}{}x{}KB_{}_d{}".format(prefix, nFiles, fileSize // 1000, todaysDatetime, dirIdx)
+                        for dirIdx in range(1, nDirs + 1)]
+        datasetDIDs = createCollections(loggerName, scope, datasetNames)
+
         self.logger.debug("Launching pool of {} workers".format(nWorkers))
 
-        # Create array of args for each process
+        # Create array of args for each process, skipping directories whose dataset could not be created.
         #
         args_arr = [
             (
@@ -209,11 +218,13 @@ class TestReplicationBulk(Task):
                 scope,
                 lifetime,
                 parentDID,
+                datasetDID,
                 dirIdx,
                 nDirs,
                 namingPrefix,
             )
-            for dirIdx in range(1, nDirs + 1)
+            for dirIdx, datasetDID in enumerate(datasetDIDs, start=1)
+            if datasetDID
         ]
 
         # Launch pool of worker processes, and join() to wait for all to complete
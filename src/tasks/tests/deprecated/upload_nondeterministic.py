@@ -85,7 +85,7 @@ class TestUploadNondeterministic(Task):
 
             # Ingest data.
             #
-            for lfn, pfn in zip(spoofer.lfns, spoofer.pfns):
+            for lfn, pfn in spoofer:
                 self.logger.info("Uploading file with path {}".format(pfn.abspath))
                 gfal.mkdir_rec(pfn.dirname, 775)
                 gfal.filecopy(params, "file://" + lfn.abspath, pfn.abspath)
@@ -1,15 +1,17 @@
 import json
 import os
-import subprocess
 import time
 from datetime import datetime
 
-from elasticsearch import Elasticsearch
 from rucio.client.didclient import DIDClient
-from rucio.common.exception import DataIdentifierNotFound
 
+from common.es import pushToDatabases
+from common.ingestion.load import LoadGenerator
+from common.ingestion.service import IngestServiceController
+from common.ingestion.staging import StagingWriter
+from common.rucio.ingestion import IngestionPoller
 from tasks.task import Task
-from utility import bcolors, generateRandomFile, getObsCoreMetadataDict
+from utility import bcolors, getObsCoreMetadataDict
 
 
 class TestIngestionLocal(Task):
@@ -32,10 +34,30 @@ class TestIngestionLocal(Task):
         - ingestion_polling_frequency_s: The frequency at which the ingestion service should poll for new files.
         - ingestion_iteration_batch_size: The number of files that the ingestion service should batch together for 
             ingestion per iteration.
+        - ingestion_n_processes: The number of processes the ingestion service should use (default 1).
+        - ingestion_ready_pattern (optional): A regular expression matched against the ingestion service's output
+            to decide when it is ready (default is to wait for any output).
+        - ingestion_ready_timeout_s: How long to wait for the ingestion service to become ready (default 30).
+        - ingestion_sweep (optional): A list of dictionaries with keys n_processes and/or batch_size. The test is
+            run once per configuration, restarting the ingestion service each time, so that throughput can be
+            compared across configurations.
         - rucio_ingest_rse_name: The (Rucio) identifier of the RSE to ingest data into.
         - rucio_pfn_basepath: The PFN basepath (required for non-deterministic ingestion backends only)
-        - n_retries: The number of times to poll for files to be picked up and ingested.
-        - delay_s: The interval at which to poll at in seconds.
+        - n_retries: Together with delay_s, sets how long to poll for files to be picked up and ingested
+            ((n_retries - 1) * delay_s seconds).
+        - delay_s: The maximum interval at which to poll at in seconds.
+        - initial_delay_s: The initial interval at which to poll at in seconds, doubled after each poll up to
+            delay_s (default 1).
+        - staging_write_threads: The number of threads used to write files to the staging area (default 4).
+        - staging_tmp_dir (optional): The directory files are written to before being moved into the staging
+            area. Must be on the same filesystem as ingest_dir and outside the tree watched by the ingestion
+            service (default is <scope> in a hidden sibling of ingest_dir, i.e. <parent>/.<ingest_dir name>.tmp).
+        - load (optional): Generate files following an arrival process for a fixed duration, polling
+            concurrently, instead of writing n_files at once. A dictionary with keys:
+            - process: The arrival process, one of constant || poisson || bursts.
+            - rate_hz: The mean arrival rate in files per second.
+            - duration_s: How long to generate files for in seconds.
+            - burst_size: The number of files per burst (bursts only).
 
         :param logger: The logger instance to be used for logging.
         """
@@ -51,39 +73,138 @@ class TestIngestionLocal(Task):
         self.ingestion_backend_name = None
         self.ingestion_polling_frequency_s = None
         self.ingestion_iteration_batch_size = None
+        self.ingestion_n_processes = None
+        self.ingestion_ready_pattern = None
+        self.ingestion_ready_timeout_s = None
+        self.ingestion_sweep = None
         self.rucio_ingest_rse_name = None
         self.rucio_pfn_basepath = None
         self.n_retries = None
         self.delay_s = None
+        self.initial_delay_s = None
+        self.staging_write_threads = None
+        self.staging_tmp_dir = None
+        self.load = None
         self.outputDatabases = None
 
     def begin_ingest_service(self, ingest_dir, metadata_schema, metadata_suffix, ingestion_backend_name,
-                             frequency, batch_size, rucio_ingest_rse_name=None, rucio_pfn_basepath=None):
+                             frequency, batch_size, rucio_ingest_rse_name=None, rucio_pfn_basepath=None,
+                             n_processes=1):
+        """ Start the ingest service, returning its controller once ready (or None if it failed to start). """
         # read the metadata schema into a file
         try:
             metadata_schema = json.loads(metadata_schema)
         except Exception as e:
-            self.logger.critica(e)
-            return False
+            self.logger.critical(e)
+            return None
         with open("/tmp/metadata_schema.json", 'w') as f:
             f.write(json.dumps(metadata_schema))
 
         # make the ingestion directory
         os.makedirs(ingest_dir, exist_ok=True)
 
-        cmd = ['srcnet-tools-ingest',
-               '--frequency', str(frequency),
-               '--batch-size', str(batch_size),
-               '--metadata-schema-path', '/tmp/metadata_schema.json',
-               '--metadata-suffix', metadata_suffix,
-               '--n-processes', "1",
-               '--ingestion-backend-name', ingestion_backend_name,
-               '--rucio-ingest-rse-name', rucio_ingest_rse_name]
-        if rucio_pfn_basepath:
-            cmd = cmd + ['--rucio-pfn-basepath', rucio_pfn_basepath]
+        service = IngestServiceController(
+            self.logger,
+            "/tmp/metadata_schema.json",
+            metadata_suffix,
+            ingestion_backend_name,
+            frequency,
+            batch_size,
+            nProcesses=n_processes,
+            rucioIngestRseName=rucio_ingest_rse_name,
+            rucioPfnBasepath=rucio_pfn_basepath,
+            readyPattern=self.ingestion_ready_pattern,
+            readyTimeoutS=self.ingestion_ready_timeout_s
+        )
+        try:
+            service.start()
+        except OSError as e:
+            self.logger.critical("Could not start ingestion service: {}".format(repr(e)))
+            return None
+        if not service.waitUntilReady():
+            service.stop()
+            return None
+        return service
+
+    def _expectedMetadata(self, file_name):
+        """ Get the metadata expected to be set for an ingested file with name, <file_name>. """
+        return getObsCoreMetadataDict(
+            access_url="https://ivoa.datalink.srcdev.skao.int/rucio/links?id={}:{}".format(self.scope, file_name)
+        )
+
+    def _ingest(self, writer, prefix, entry):
+        """
+        Stage files with prefix, <prefix>, using <writer> and poll for their ingestion, adding results to <entry>.
+        """
+        n_files = self.n_files
+        poller = IngestionPoller(self.logger, DIDClient(), self.scope, self._expectedMetadata)
+        if self.load:
+            # Write files following the requested arrival process while polling concurrently.
+            generator = LoadGenerator(
+                self.logger,
+                writer,
+                self.sizes,
+                prefix,
+                process=self.load.get("process", "constant"),
+                rateHz=self.load.get("rate_hz", 1),
+                durationS=self.load.get("duration_s", 60),
+                burstSize=self.load.get("burst_size", 10),
+                onWritten=poller.add
+            )
+            generator.start()
+            while generator.is_alive():
+                poller.pollRound()
+                time.sleep(self.delay_s)
+            n_files = generator.nFilesWritten
+            entry["n_files"] = n_files
+            entry.update(generator.summary())
+        else:
+            with self.span("stage"):
+                written = writer.writeBatch(
+                    self.sizes[:n_files], ["{}_{}".format(prefix, idx) for idx in range(n_files)])
+            for idx, (file_name, written_at) in enumerate(written):
+                poller.add(file_name, written_at, self.sizes[idx])
+
+        # Poll for files (backing off up to every <delay_s> sec) to be added by ingestion service.
+        # Once found, will check metadata is set correctly too (there can be a short
+        # delay after upload for this to be set)
+        with self.span("poll"):
+            succeeded, failed = poller.run(
+                (self.n_retries - 1) * self.delay_s, self.delay_s, initialIntervalS=self.initial_delay_s)
+        entry.update(poller.summary())
+        self.logger.info("Ingestion latency p50: {}s, p90: {}s, p99: {}s, max: {}s".format(
+            *[entry["ingestion_latency_{}_s".format(key)] for key in ("p50", "p90", "p99", "max")]))
+        if self.load:
+            self.logger.info("Throughput written: {} files/s ({} B/s), ingested: {} files/s ({} B/s)".format(
+                entry["write_throughput_files_per_s"], entry["write_throughput_bytes_per_s"],
+                entry["ingest_throughput_files_per_s"], entry["ingest_throughput_bytes_per_s"]))
 
-        # call as child process so doesn't block main thread
-        subprocess.Popen(cmd)
+        if failed == 0:
+            self.logger.info(
+                "{}Successfully ingested {} / {} files.{}".format(
+                    bcolors.OKGREEN,
+                    succeeded,
+                    n_files,
+                    bcolors.ENDC
+                )
+            )
+            entry["succeeded_at"] = datetime.now().isoformat()
+            entry["state"] = "INGESTION-SUCCESSFUL"
+            entry["success_rate"] = 1.0
+            entry["is_ingestion_successful"] = 1
+        else:
+            self.logger.info(
+                "{}Failed to ingest {} / {} files.{}".format(
+                    bcolors.FAIL,
+                    failed,
+                    n_files,
+                    bcolors.ENDC
+                )
+            )
+            entry["failed_at"] = datetime.now().isoformat()
+            entry["state"] = "INGESTION-FAILED"
+            entry["success_rate"] = succeeded / (succeeded + failed)
+            entry["is_ingestion_successful"] = 0
 
     def run(self, args, kwargs):
         super().run()
@@ -101,9 +222,18 @@ class TestIngestionLocal(Task):
             self.ingestion_backend_name = kwargs["ingestion_backend_name"]
             self.ingestion_polling_frequency_s = kwargs["ingestion_polling_frequency_s"]
             self.ingestion_iteration_batch_size = kwargs["ingestion_iteration_batch_size"]
+            self.ingestion_n_processes = kwargs.get("ingestion_n_processes", 1)
+            self.ingestion_ready_pattern = kwargs.get("ingestion_ready_pattern")
+            self.ingestion_ready_timeout_s = kwargs.get("ingestion_ready_timeout_s", 30)
+            self.ingestion_sweep = kwargs.get("ingestion_sweep")
             self.rucio_ingest_rse_name = kwargs["rucio_ingest_rse_name"]
+            self.rucio_pfn_basepath = kwargs.get("rucio_pfn_basepath")
             self.n_retries = kwargs["n_retries"]
             self.delay_s = kwargs["delay_s"]
+            self.initial_delay_s = kwargs.get("initial_delay_s", min(1, self.delay_s))
+            self.staging_write_threads = kwargs.get("staging_write_threads", 4)
+            self.staging_tmp_dir = kwargs.get("staging_tmp_dir")
+            self.load = kwargs.get("load")
             self.outputDatabases = kwargs["output"]["databases"]
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for test.")
@@ -112,7 +242,7 @@ class TestIngestionLocal(Task):
 
         # Validate kwargs
         if isinstance(self.sizes, list):
-            if len(self.sizes) != self.n_files:
+            if len(self.sizes) != self.n_files and not self.load:
                 self.logger.critical(
                     "File sizes array is a different length to n_files"
                 )
@@ -122,149 +252,84 @@ class TestIngestionLocal(Task):
         else:
             self.logger.critical("File sizes should either be a list or int")
             return False
-
-        self.logger.info("Starting ingestion engine...")
-
-        # Begin the ingest service locally
-        self.begin_ingest_service(self.ingest_dir, self.metadata_schema, self.metadata_suffix,
-                                  self.ingestion_backend_name, self.ingestion_polling_frequency_s,
-                                  self.ingestion_iteration_batch_size, self.rucio_ingest_rse_name,
-                                  self.rucio_pfn_basepath)
-        
-        # Set up log message:
-        test_id = "ingestion_test_{}".format(datetime.now().isoformat())
-        entry = {
-            "task_name": self.task_name,
-            "name": test_id,
-            "scope": self.scope,
-            "n_files": self.n_files,
-            "lifetime": self.lifetime,
-            "attempted_at": datetime.now().isoformat(),
-        }
+        if self.load and self.load.get("process", "constant") not in LoadGenerator.PROCESSES:
+            self.logger.critical("Unknown arrival process {}, expected one of {}".format(
+                self.load.get("process"), " || ".join(LoadGenerator.PROCESSES)))
+            return False
 
         # Generate random files, and associated metadata files, of specified sizes and
-        # names in subdirectory of staging directory with name equivalent to the scope:
-        new_names = []
-        for idx in range(self.n_files):
-            # Generate random file of size <size>
-            file = generateRandomFile(
-                self.sizes[idx],
-                prefix="{}_{}".format(self.prefix, idx),
-                dirname=os.path.join(self.ingest_dir, 'staging', self.scope)
+        # names in subdirectory of staging directory with name equivalent to the scope.
+        # Files are written outside the watched ingest_dir and moved into place once complete, and the time each
+        # file appeared in the staging area is kept to measure ingestion latency.
+        if self.staging_tmp_dir is None:
+            head, tail = os.path.split(os.path.normpath(self.ingest_dir))
+            self.staging_tmp_dir = os.path.join(head, ".{}.tmp".format(tail), self.scope)
+        try:
+            writer = StagingWriter(
+                self.logger,
+                os.path.join(self.ingest_dir, 'staging', self.scope),
+                self.scope,
+                self.lifetime,
+                self._expectedMetadata,
+                tmpDir=self.staging_tmp_dir,
+                metaSuffix=self.metadata_suffix,
+                nThreads=self.staging_write_threads
             )
+        except ValueError as e:
+            self.logger.critical("Could not set up staging area, set staging_tmp_dir to a directory on the same "
+                                 "filesystem as ingest_dir.")
+            self.logger.critical(repr(e))
+            return False
 
-            file_path = file.name
-            file_name = os.path.basename(file_path)
-            new_names.append(file_name)
-
-            meta_dict = {
-                "name": file_name,
-                "namespace": self.scope,
+        # Each configuration is run against a freshly started ingestion service.
+        configurations = self.ingestion_sweep or [{}]
+        entries = []
+        for idx, configuration in enumerate(configurations):
+            n_processes = configuration.get("n_processes", self.ingestion_n_processes)
+            batch_size = configuration.get("batch_size", self.ingestion_iteration_batch_size)
+            prefix = "{}_r{}".format(self.prefix, idx) if self.ingestion_sweep else self.prefix
+
+            self.logger.info("Starting ingestion engine with {} processes and batch size {}...".format(
+                n_processes, batch_size))
+
+            # Begin the ingest service locally
+            with self.span("start_service", n_processes=n_processes, batch_size=batch_size):
+                service = self.begin_ingest_service(self.ingest_dir, self.metadata_schema, self.metadata_suffix,
+                                                    self.ingestion_backend_name, self.ingestion_polling_frequency_s,
+                                                    batch_size, self.rucio_ingest_rse_name, self.rucio_pfn_basepath,
+                                                    n_processes=n_processes)
+            if service is None:
+                self.logger.critical("Ingestion service failed to start, skipping configuration")
+                continue
+
+            # Set up log message:
+            test_id = "ingestion_test_{}".format(datetime.now().isoformat())
+            entry = {
+                "task_name": self.task_name,
+                "name": test_id,
+                "scope": self.scope,
+                "n_files": self.n_files,
                 "lifetime": self.lifetime,
-                "meta": getObsCoreMetadataDict(
-                    access_url="https://ivoa.datalink.srcdev.skao.int/rucio/links?id={}:{}".format(
-                        self.scope, file_name)
-                    )
+                "ingestion_n_processes": n_processes,
+                "ingestion_iteration_batch_size": batch_size,
+                "ingestion_polling_frequency_s": self.ingestion_polling_frequency_s,
+                "attempted_at": datetime.now().isoformat(),
             }
-            with open("{}.meta".format(file_path), 'w') as meta_file:
-                json.dump(meta_dict, meta_file, indent=2)
-
-        # Poll for files (every <delay_s> sec) to be added by ingestion service.
-        # Once found, will check metadata is set correctly too (there can be a short
-        # delay after upload for this to be set)
-        did_client = DIDClient()
-        max_retries = self.n_retries
-        succeeded = 0
-        failed = 0
-        for file_name in new_names:
-            retries = 0
-            while retries < max_retries:
-                try:
-                    did = did_client.get_did(self.scope, file_name)
-                    if did:
-                        # Test get metadata, since this is set via a separate call
-                        # following file ingestion
-                        retrieved_meta = did_client.get_metadata(
-                            did["scope"],
-                            did["name"],
-                            plugin="POSTGRES_JSON"
-                        )
-                        expected_meta = getObsCoreMetadataDict(
-                            access_url="https://ivoa.datalink.srcdev.skao.int/rucio/links?id={}:{}".format(
-                                self.scope, file_name)
-                            )
-                        if not retrieved_meta == expected_meta:
-                            self.logger.critical(
-                                "Metadata mismatch for DID: {}".format(did["name"])
-                            )
-                            failed += 1
-                            break
-                        self.logger.info(
-                            "DID found with expected metadata: {}".format(did)
-                        )
-                        succeeded += 1
-                        break
-                except DataIdentifierNotFound:
-                    # Likely because the ingestion service has not yet picked up the
-                    # newly created files
-                    did_name = "{}:{}".format(self.scope, file_name)
-                    self.logger.info(
-                        "Waiting for ingestion of DID {}...".format(did_name)
-                    )
-                    time.sleep(self.delay_s)
-                    retries += 1
-                    if retries == max_retries:
-                        self.logger.critical(
-                            "DID {} not found after {} sec".format(
-                                did_name,
-                                retries * self.delay_s
-                            )
-                        )
-                        failed += 1
-                        break
-                except Exception as e:
-                    self.logger.critical(
-                        "Error encountered when polling for data {}".format(e)
-                    )
-                    failed += 1
-                    break
-
-        if failed == 0:
-            self.logger.info(
-                "{}Successfully ingested {} / {} files.{}".format(
-                    bcolors.OKGREEN,
-                    succeeded,
-                    self.n_files,
-                    bcolors.ENDC
-                )
-            )
-            entry["succeeded_at"] = datetime.now().isoformat()
-            entry["state"] = "INGESTION-SUCCESSFUL"
-            entry["success_rate"] = 1.0
-            entry["is_ingestion_successful"] = 1
-        else:
-            self.logger.info(
-                "{}Failed to ingest {} / {} files.{}".format(
-                    bcolors.FAIL,
-                    failed,
-                    self.n_files,
-                    bcolors.ENDC
-                )
-            )
-            entry["failed_at"] = datetime.now().isoformat()
-            entry["state"] = "INGESTION-FAILED"
-            entry["success_rate"] = succeeded / (succeeded + failed)
-            entry["is_ingestion_successful"] = 0
+            try:
+                self._ingest(writer, prefix, entry)
+            finally:
+                service.stop()
+            entries.append(entry)
+
+        if self.ingestion_sweep:
+            for entry in entries:
+                self.logger.info("n_processes={}, batch_size={}: ingested {} files/s, p50 latency {}s".format(
+                    entry["ingestion_n_processes"], entry["ingestion_iteration_batch_size"],
+                    entry["ingest_throughput_files_per_s"], entry["ingestion_latency_p50_s"]))
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database: {}...".format(database['uri']))
-                    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                    es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                    es.index(index=database["index"], id=entry['name'], body=entry)
+        pushToDatabases(self.logger.name, self.outputDatabases, entries, idKey="name")
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -284,8 +349,15 @@ class TestIngestionRemote(Task):
         - sizes (array or int): The sizes of the files (bytes) to be created.
         - ingest_dir: The directory where files will be written (staging area monitored
             by ingestion).
-        - n_retries: The number of times to poll for files to be picked up and ingested.
-        - delay_s: The interval at which to poll at in seconds.
+        - n_retries: Together with delay_s, sets how long to poll for files to be picked up and ingested
+            ((n_retries - 1) * delay_s seconds).
+        - delay_s: The maximum interval at which to poll at in seconds.
+        - initial_delay_s: The initial interval at which to poll at in seconds, doubled after each poll up to
+            delay_s (default 1).
+        - staging_write_threads: The number of threads used to write files to the staging area (default 4).
+        - staging_tmp_dir (optional): The directory files are written to before being moved into the staging
+            area. Must be on the same filesystem as ingest_dir and outside the tree watched by the ingestion
+            service (default is <scope> in a hidden sibling of ingest_dir, i.e. <parent>/.<ingest_dir name>.tmp).
 
         :param logger: The logger instance to be used for logging.
         """
@@ -298,9 +370,18 @@ class TestIngestionRemote(Task):
         self.ingest_dir = None
         self.n_retries = None
         self.delay_s = None
+        self.initial_delay_s = None
+        self.staging_write_threads = None
+        self.staging_tmp_dir = None
         self.meta_suffix = "meta"
         self.outputDatabases = None
 
+    def _expectedMetadata(self, file_name):
+        """ Get the metadata expected to be set for an ingested file with name, <file_name>. """
+        return getObsCoreMetadataDict(
+            access_url="https://ivoa.datalink.srcdev.skao.int/rucio/links?id={}:{}".format(self.scope, file_name)
+        )
+
     def run(self, args, kwargs):
         super().run()
         self.tic()
@@ -314,6 +395,9 @@ class TestIngestionRemote(Task):
             self.ingest_dir = kwargs["ingest_dir"]
             self.n_retries = kwargs["n_retries"]
             self.delay_s = kwargs["delay_s"]
+            self.initial_delay_s = kwargs.get("initial_delay_s", min(1, self.delay_s))
+            self.staging_write_threads = kwargs.get("staging_write_threads", 4)
+            self.staging_tmp_dir = kwargs.get("staging_tmp_dir")
             self.meta_suffix = kwargs.get("meta_suffix", "meta")
             self.outputDatabases = kwargs["output"]["databases"]
         except KeyError as e:
@@ -346,88 +430,44 @@ class TestIngestionRemote(Task):
         }
 
         # Generate random files, and associated metadata files, of specified sizes and
-        # names in subdirectory of staging directory with name equivalent to the scope:
-        new_names = []
-        for idx in range(self.n_files):
-            # Generate random file of size <size>
-            file = generateRandomFile(
-                self.sizes[idx],
-                prefix="{}_{}".format(self.prefix, idx),
-                dirname=os.path.join(self.ingest_dir, self.scope)
+        # names in subdirectory of staging directory with name equivalent to the scope.
+        # Files are written outside the watched ingest_dir and moved into place once complete, and the time each
+        # file appeared in the staging area is kept to measure ingestion latency.
+        if self.staging_tmp_dir is None:
+            head, tail = os.path.split(os.path.normpath(self.ingest_dir))
+            self.staging_tmp_dir = os.path.join(head, ".{}.tmp".format(tail), self.scope)
+        try:
+            writer = StagingWriter(
+                self.logger,
+                os.path.join(self.ingest_dir, self.scope),
+                self.scope,
+                self.lifetime,
+                lambda file_name: getObsCoreMetadataDict(),
+                tmpDir=self.staging_tmp_dir,
+                metaSuffix=self.meta_suffix,
+                nThreads=self.staging_write_threads
             )
-
-            file_path = file.name
-            file_name = os.path.basename(file_path)
-            new_names.append(file_name)
-
-            meta_dict = {
-                "name": file_name,
-                "namespace": self.scope,
-                "lifetime": self.lifetime,
-                "meta": getObsCoreMetadataDict()
-            }
-            with open("{}.meta".format(file_path), 'w') as meta_file:
-                json.dump(meta_dict, meta_file, indent=2)
-
-        # Poll for files (every <delay_s> sec) to be added by ingestion service.
+        except ValueError as e:
+            self.logger.critical("Could not set up staging area, set staging_tmp_dir to a directory on the same "
+                                 "filesystem as ingest_dir.")
+            self.logger.critical(repr(e))
+            return False
+        poller = IngestionPoller(self.logger, DIDClient(), self.scope, self._expectedMetadata)
+        with self.span("stage"):
+            written = writer.writeBatch(
+                self.sizes, ["{}_{}".format(self.prefix, idx) for idx in range(self.n_files)])
+        for idx, (file_name, written_at) in enumerate(written):
+            poller.add(file_name, written_at, self.sizes[idx])
+
+        # Poll for files (backing off up to every <delay_s> sec) to be added by ingestion service.
         # Once found, will check metadata is set correctly too (there can be a short
         # delay after upload for this to be set)
-        did_client = DIDClient()
-        max_retries = self.n_retries
-        succeeded = 0
-        failed = 0
-        for file_name in new_names:
-            retries = 0
-            while retries < max_retries:
-                try:
-                    did = did_client.get_did(self.scope, file_name)
-                    if did:
-                        # Test get metadata, since this is set via a separate call
-                        # following file ingestion
-                        retrieved_meta = did_client.get_metadata(
-                            did["scope"],
-                            did["name"],
-                            plugin="POSTGRES_JSON"
-                        )
-                        expected_meta = getObsCoreMetadataDict(
-                            access_url="https://ivoa.datalink.srcdev.skao.int/rucio/links?id={}:{}".format(
-                                self.scope, file_name)
-                            )
-                        if not retrieved_meta == expected_meta:
-                            self.logger.critical(
-                                "Metadata mismatch for DID: {}".format(did["name"])
-                            )
-                            failed += 1
-                            break
-                        self.logger.info(
-                            "DID found with expected metadata: {}".format(did)
-                        )
-                        succeeded += 1
-                        break
-                except DataIdentifierNotFound:
-                    # Likely because the ingestion service has not yet picked up the
-                    # newly created files
-                    did_name = "{}:{}".format(self.scope, file_name)
-                    self.logger.info(
-                        "Waiting for ingestion of DID {}...".format(did_name)
-                    )
-                    time.sleep(self.delay_s)
-                    retries += 1
-                    if retries == max_retries:
-                        self.logger.critical(
-                            "DID {} not found after {} sec".format(
-                                did_name,
-                                retries * self.delay_s
-                            )
-                        )
-                        failed += 1
-                        break
-                except Exception as e:
-                    self.logger.critical(
-                        "Error encountered when polling for data {}".format(e)
-                    )
-                    failed += 1
-                    break
+        with self.span("poll"):
+            succeeded, failed = poller.run(
+                (self.n_retries - 1) * self.delay_s, self.delay_s, initialIntervalS=self.initial_delay_s)
+        entry.update(poller.summary())
+        self.logger.info("Ingestion latency p50: {}s, p90: {}s, p99: {}s, max: {}s".format(
+            *[entry["ingestion_latency_{}_s".format(key)] for key in ("p50", "p90", "p99", "max")]))
 
         if failed == 0:
             self.logger.info(
@@ -458,12 +498,7 @@ class TestIngestionRemote(Task):
         
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database...")
-                    es = Elasticsearch([database['uri']])
-                    es.index(index=database["index"], id=entry['name'], body=entry)
+        pushToDatabases(self.logger.name, self.outputDatabases, [entry], idKey="name")
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
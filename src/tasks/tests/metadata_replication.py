@@ -2,7 +2,6 @@ import os
 import time
 from datetime import datetime
 
-from elasticsearch import Elasticsearch
 from rucio.client.subscriptionclient import SubscriptionClient
 from rucio.client.didclient import DIDClient
 from rucio.client.replicaclient import ReplicaClient
@@ -10,6 +9,8 @@ from rucio.client.ruleclient import RuleClient
 from rucio.client.uploadclient import UploadClient
 from rucio.common.exception import SubscriptionNotFound
 
+from common.es import pushToDatabases
+from common.polling import Poller
 from common.rucio.helpers import createCollection, matchRules
 from tasks.task import Task
 from utility import bcolors, generateRandomFile
@@ -58,6 +59,7 @@ class MetadataReplication(Task):
         self.priority = None
         self.timeout = None
         self.delay_s = None
+        self.initial_delay_s = None
         self.outputDatabases = None
 
     def run(self, args, kwargs):
@@ -82,6 +84,7 @@ class MetadataReplication(Task):
         self.priority = kwargs["priority"]
         self.timeout = kwargs["timeout"]
         self.delay_s = kwargs["delay_s"]
+        self.initial_delay_s = kwargs.get("initial_delay_s", min(1, self.delay_s))
         self.outputDatabases = kwargs["output"]["databases"]
 
         # Instantiate Rucio client objects; useful to see UploadClient logs
@@ -104,7 +107,8 @@ class MetadataReplication(Task):
         datasetDID = createCollection(
             self.logger.name,
             self.scope,
-            "{}_{}".format(self.datasetName, datetime.now().strftime("%d%m%yT%H.%M.%S"))
+            "{}_{}".format(self.datasetName, datetime.now().strftime("%d%m%yT%H.%M.%S")),
+            client=did_client
         )
         if not datasetDID:
             return False
@@ -255,79 +259,89 @@ class MetadataReplication(Task):
             "rules_status": "Fail",
         }
 
-        # Verify replication rules have been set correctly
+        # Verify replication rules have been set correctly, polling more slowly the longer it takes
         #
         start_time = time.time()
-        while time.time() - start_time < self.timeout:
-            try:
-                found_rules = list(rule_client.list_replication_rules(
-                    {'scope': self.scope, 'name': dataset_name}
-                ))
-            except Exception as e:
-                self.logger.critical(
-                    bcolors.FAIL +
-                    "Failed to list replication rules: {}".format(str(e)) +
-                    bcolors.ENDC
-                )
-                return False
+        rules_poller = Poller(
+            self.logger,
+            initialIntervalS=self.initial_delay_s,
+            maxIntervalS=self.delay_s,
+            deadlineS=self.timeout
+        )
+        try:
+            rules_created, found_rules = rules_poller.poll(
+                lambda: list(rule_client.list_replication_rules({'scope': self.scope, 'name': dataset_name})),
+                lambda rules: matchRules(self.logger.name, self.replicationRules, rules),
+                seen=lambda rules: len(rules) > 0,
+                description="replication rules to be created"
+            )
+        except Exception as e:
+            self.logger.critical(
+                bcolors.FAIL +
+                "Failed to list replication rules: {}".format(str(e)) +
+                bcolors.ENDC
+            )
+            return False
+        es_entry.update(rules_poller.timings(prefix="rules_"))
 
-            if matchRules(self.logger.name, self.replicationRules, found_rules):
-                self.logger.info(
-                    bcolors.OKGREEN +
-                    "All replication rules created successfully." +
-                    bcolors.ENDC
-                )
-                es_entry.update({
-                    "rules_status": "Success",
-                    "replicated_rse": ', '.join(rule['rse_expression'] for rule in found_rules),
-                    "state": ', '.join(rule['state'] for rule in found_rules)
-                })
-                break
-            else:
-                self.logger.info("Waiting for replication rules to be created...")
-                time.sleep(self.delay_s)
+        if rules_created:
+            self.logger.info(
+                bcolors.OKGREEN +
+                "All replication rules created successfully." +
+                bcolors.ENDC
+            )
+            es_entry.update({
+                "rules_status": "Success",
+                "replicated_rse": ', '.join(rule['rse_expression'] for rule in found_rules),
+                "state": ', '.join(rule['state'] for rule in found_rules)
+            })
         else:
             self.logger.error(
                 bcolors.FAIL +
-                "Timeout reached without detecting expected replica rules.{}" +
+                "Timeout reached without detecting expected replica rules." +
                 bcolors.ENDC
             )
 
         # Check the replicas - we only expect one file within the dataset
         #
-        while time.time() - start_time < self.timeout:
-            try:
-                replicas = list(replica_client.list_replicas(
-                    [{'scope': self.scope, 'name': dataset_name}]
-                ))
-                file_replica = replicas[-1]
-            except Exception as e:
-                self.logger.critical(
-                    bcolors.FAIL +
-                    "Failed to list replicas: {}".format(str(e)) +
-                    bcolors.ENDC
-                )
-                return False
-            
-            # Expect one replica at the intial RSE + one for each of the replication rules
-            #
-            exp_replica_count = 1 + len(self.replicationRules)
-            if len(file_replica["pfns"]) == exp_replica_count:
-                self.logger.info(
-                    bcolors.OKGREEN +
-                    "File {} found at RSEs: {}".format(
-                        file_replica['name'], ', '.join(file_replica['rses'].keys())) +
-                    bcolors.ENDC
-                )
-                es_entry.update({
-                    "replica_status": "Success",
-                    "file_name": file_replica['name'],
-                    "file_size": file_replica['bytes'],
-                    "rse": ', '.join(file_replica['rses'].keys()),
-                })
-                break
-            self.logger.info("Waiting for replicas...")
-            time.sleep(self.delay_s)
+        # Expect one replica at the intial RSE + one for each of the replication rules
+        #
+        exp_replica_count = 1 + len(self.replicationRules)
+        replicas_poller = Poller(
+            self.logger,
+            initialIntervalS=self.initial_delay_s,
+            maxIntervalS=self.delay_s,
+            deadlineS=max(self.timeout - (time.time() - start_time), 0)
+        )
+        try:
+            replicas_found, file_replica = replicas_poller.poll(
+                lambda: list(replica_client.list_replicas([{'scope': self.scope, 'name': dataset_name}]))[-1],
+                lambda replica: len(replica["pfns"]) == exp_replica_count,
+                seen=lambda replica: len(replica["pfns"]) > 1,
+                description="replicas"
+            )
+        except Exception as e:
+            self.logger.critical(
+                bcolors.FAIL +
+                "Failed to list replicas: {}".format(str(e)) +
+                bcolors.ENDC
+            )
+            return False
+        es_entry.update(replicas_poller.timings(prefix="replicas_"))
+
+        if replicas_found:
+            self.logger.info(
+                bcolors.OKGREEN +
+                "File {} found at RSEs: {}".format(
+                    file_replica['name'], ', '.join(file_replica['rses'].keys())) +
+                bcolors.ENDC
+            )
+            es_entry.update({
+                "replica_status": "Success",
+                "file_name": file_replica['name'],
+                "file_size": file_replica['bytes'],
+                "rse": ', '.join(file_replica['rses'].keys()),
+            })
         else:
             self.logger.error(
                 bcolors.FAIL +
@@ -342,13 +356,7 @@ class MetadataReplication(Task):
             "Sending the following to Elasticsearch: {}".format(es_entry) +
             bcolors.ENDC
         )
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database...")
-                    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                    es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                    es.index(index=database["index"], id=es_entry['file_name'], body=es_entry)
+        pushToDatabases(self.logger.name, self.outputDatabases, [es_entry], idKey="file_name")
 
         self.toc()
         self.logger.info(
@@ -1,12 +1,12 @@
 from datetime import datetime
 import os
-import time
 
-from elasticsearch import Elasticsearch
 from rucio.client.uploadclient import UploadClient
 from rucio.client.didclient import DIDClient
 
+from common.es import pushToDatabases
 from common.rucio.helpers import createCollection
+from common.rucio.metrics import UPLOAD_BYTES, UPLOAD_RATE, UPLOADS
 from tasks.task import Task
 from utility import bcolors, generateRandomFile
 
@@ -130,8 +130,6 @@ class TestUpload(Task):
                         "is_upload_submitted": 1,
                     }
                     try:
-                        st = time.time()
-
                         items = [{
                             "path": filePath,
                             "rse": rseDst,
@@ -141,14 +139,18 @@ class TestUpload(Task):
                             "force_scheme": None,
                             "transfer_timeout": 60,
                         }]
-                        client = UploadClient(logger=self.logger)
-                        client.upload(items=items)
+                        with self.span("upload", rse=rseDst, protocol=protocol) as span:
+                            client = UploadClient(logger=self.logger)
+                            client.upload(items=items)
 
                         # Add keys for successful upload.
-                        entry["transfer_duration"] = time.time() - st
+                        entry["transfer_duration"] = span.duration
                         entry["transfer_rate"] = entry["file_size"] / (entry["transfer_duration"]*1000)
                         entry["state"] = "UPLOAD-SUCCESSFUL"
                         entry["is_upload_successful"] = 1
+                        UPLOADS.inc(task=self.taskName, rse=rseDst, outcome="successful")
+                        UPLOAD_BYTES.inc(entry["file_size"], task=self.taskName, rse=rseDst)
+                        UPLOAD_RATE.observe(entry["file_size"] / span.duration, task=self.taskName, rse=rseDst)
                         self.logger.debug("Upload complete")
 
                         # Attach to dataset
@@ -166,9 +168,14 @@ class TestUpload(Task):
                             scope = tokens_f[0]
                             name = tokens_f[1]
                             attachment["dids"].append({"scope": scope, "name": name})
-                            did_client.attach_dids_to_dids(attachments=[attachment])
+                            with self.span("attach") as span:
+                                did_client.attach_dids_to_dids(attachments=[attachment])
+                            entry["attach_duration"] = span.duration
+                            entry["is_attach_successful"] = 1
                         except Exception as e:
                             self.logger.warning(repr(e))
+                            entry["attach_error"] = repr(e).strip("'")
+                            entry["is_attach_failed"] = 1
                         self.logger.debug("Attached file to dataset")
                     except Exception as e:
                         self.logger.warning("Upload failed: {}".format(e))
@@ -178,6 +185,7 @@ class TestUpload(Task):
                         entry["error_details"] = repr(e).strip("'")
                         entry["state"] = "UPLOAD-FAILED"
                         entry["is_upload_failed"] = 1
+                        UPLOADS.inc(task=self.taskName, rse=rseDst, outcome="failed")
                     if not passed_files:
                         os.remove(filePath)
 
@@ -185,14 +193,7 @@ class TestUpload(Task):
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Sending output to ES database...")
-                    auth = (os.getenv("ELASTICSEARCH_USERNAME"), os.getenv("ELASTICSEARCH_PASSWORD"))
-                    es = Elasticsearch([database["uri"]], basic_auth=auth if all(auth) else None)
-                    for entry in entries:
-                        es.index(index=database["index"], id=entry['name'], body=entry)
+        pushToDatabases(self.logger.name, self.outputDatabases, entries, idKey="name")
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
@@ -1,12 +1,16 @@
 import copy
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import os
 import random
+import time
 
 from rucio.client.uploadclient import Client, UploadClient
 
-from elasticsearch import Elasticsearch
-
+from common.es import pushToDatabases
 from common.rucio.helpers import createCollection
+from common.rucio.metrics import UPLOAD_BYTES, UPLOAD_RATE, UPLOADS
+from common.rucio.rules import RuleTracker
 from tasks.task import Task
 from utility import bcolors, generateRandomFile
 
@@ -27,36 +31,199 @@ class TestUploadReplication(Task):
         self.namingPrefix = None
         self.ebId = None
         self.productId = None
+        self.batched = None
+        self.ruleSubmissionThreads = None
+        self.trackRules = None
+        self.ruleTrackingKwargs = None
 
-    def run(self, args, kwargs):
-        super().run()
-        self.tic()
+        self.entries = []           # per-file and per-rule records to output
+        self.ruleTracker = None
+
+    def _upload(self, rseSrc, size):
+        """
+        Generate a random file of size <size> and upload it to <rseSrc>.
+
+        Returns the file DID as a {"scope": ..., "name": ...} dict (or None if the upload failed) and the
+        corresponding file entry.
+        """
+        f = generateRandomFile(size, prefix=self.namingPrefix)
+        didName = "{}.{}/{}".format(self.ebId, self.productId, os.path.basename(f.name))
+        entry = {
+            "task_name": self.taskName,
+            "type": "file",
+            "scope": self.scope,
+            "name": didName,
+            "file_size": size,
+            "from_rse": rseSrc,
+            "attempted_at": datetime.now().isoformat(),
+        }
+        self.entries.append(entry)
         try:
-            self.activity = kwargs["activity"]
-            self.nFiles = kwargs["n_files"]
-            self.rses = kwargs["rses"]
-            self.scope = kwargs["scope"]
-            self.lifetime = kwargs["lifetime"]
-            self.sizes = kwargs["sizes"]
-            self.outputDatabases = kwargs["output"]["databases"]
-            self.taskName = kwargs["task_name"]
-            self.namingPrefix = kwargs.get("naming_prefix", "")
-            self.ebId = kwargs.get("eb_id", "test_eb_001")
-            self.productId = kwargs.get("product_id", "test_prod_001")
-        except KeyError as e:
-            self.logger.critical("Could not find necessary kwarg for task.")
-            self.logger.critical(repr(e))
+            items = [{
+                "path": f.name,
+                "rse": rseSrc,
+                "did_scope": self.scope,
+                "did_name": didName,
+                "lifetime": self.lifetime,
+                "register_after_upload": True,
+                "force_scheme": None,
+                "transfer_timeout": 60,
+            }]
+            with self.span("upload", rse=rseSrc) as span:
+                client = UploadClient(logger=self.logger)
+                client.upload(items=items)
+            entry["upload_duration"] = span.duration
+            entry["upload_rate"] = size / (entry["upload_duration"]*1000)
+            entry["state"] = "UPLOAD-SUCCESSFUL"
+            entry["is_upload_successful"] = 1
+            UPLOADS.inc(task=self.taskName, rse=rseSrc, outcome="successful")
+            UPLOAD_BYTES.inc(size, task=self.taskName, rse=rseSrc)
+            UPLOAD_RATE.observe(size / span.duration, task=self.taskName, rse=rseSrc)
+        except Exception as e:
+            self.logger.warning(repr(e))
+            entry["error"] = repr(e.__class__.__name__).strip("'")
+            entry["error_details"] = repr(e).strip("'")
+            entry["state"] = "UPLOAD-FAILED"
+            entry["is_upload_failed"] = 1
+            UPLOADS.inc(task=self.taskName, rse=rseSrc, outcome="failed")
+            return None, entry
+        finally:
+            os.remove(f.name)
+        self.logger.debug("Upload complete")
+        return {"scope": self.scope, "name": didName}, entry
+
+    def _attach(self, datasetDID, dids, fileEntries, client):
+        """ Attach <dids> to <datasetDID> in a single request, recording the outcome in <fileEntries>. """
+        tokens = datasetDID.split(":")
+        toScope = tokens[0]
+        toName = tokens[1]
+        try:
+            with self.span("attach") as span:
+                client.attach_dids_to_dids(attachments=[{"scope": toScope, "name": toName, "dids": dids}])
+        except Exception as e:
+            self.logger.warning(repr(e))
+            for entry in fileEntries:
+                entry["attach_error"] = repr(e).strip("'")
+                entry["is_attach_failed"] = 1
             return False
+        for entry in fileEntries:
+            entry["attach_duration"] = span.duration
+            entry["n_files_in_attachment"] = len(dids)
+            entry["is_attach_successful"] = 1
+        return True
 
-        # Create a dataset to house the data, named with today's date
-        # and scope <scope>.
-        #
-        datasetDID = createCollection(self.logger.name, self.scope)
+    def _addFailedRuleEntries(self, dids, rseSrc, rseDst, submittedAt, e):
+        """ Add an entry for each of <dids> recording that its rule from <rseSrc> to <rseDst> failed with <e>. """
+        for did in dids:
+            self.entries.append({
+                "task_name": self.taskName,
+                "type": "rule",
+                "scope": did["scope"],
+                "name": did["name"],
+                "from_rse": rseSrc,
+                "to_rse": rseDst,
+                "submitted_at": submittedAt,
+                "error": repr(e.__class__.__name__).strip("'"),
+                "error_details": repr(e).strip("'"),
+                "state": "RULE-SUBMISSION-FAILED",
+                "is_rule_submission_failed": 1,
+            })
 
-        # Iteratively upload a file of size from <sizes> to each
-        # RSE, attach to the dataset, add replication rules to the
-        # other listed RSEs.
-        #
+    def _addReplicationRules(self, dids, rseSrc, rseDst, client=None):
+        """ Add replication rules for all <dids> from <rseSrc> to <rseDst> in a single request. """
+        self.logger.debug(
+            bcolors.OKGREEN
+            + "RSE (dst): {}".format(rseDst)
+            + bcolors.ENDC
+        )
+        submittedAt = datetime.now().isoformat()
+        st = time.time()
+        try:
+            # Clients are not shared between threads, so build one per submission if none is passed.
+            if client is None:
+                client = Client(logger=self.logger)
+            with self.span("add_replication_rule", from_rse=rseSrc, to_rse=rseDst) as span:
+                rtn = client.add_replication_rule(
+                    dids=dids,
+                    copies=1,
+                    rse_expression=rseDst,
+                    lifetime=self.lifetime,
+                    activity=self.activity,
+                    source_replica_expression=rseSrc,
+                    asynchronous=False,
+                )
+            self.logger.debug("Rule IDs: {}".format(rtn))
+        except Exception as e:
+            self.logger.warning(repr(e))
+            self._addFailedRuleEntries(dids, rseSrc, rseDst, submittedAt, e)
+            return []
+        duration = span.duration
+        for did, ruleId in zip(dids, rtn):
+            if self.ruleTracker is not None:
+                self.ruleTracker.add(ruleId, rseSrc, rseDst, submittedAt=st)
+            self.entries.append({
+                "task_name": self.taskName,
+                "type": "rule",
+                "scope": did["scope"],
+                "name": did["name"],
+                "rule_id": ruleId,
+                "from_rse": rseSrc,
+                "to_rse": rseDst,
+                "submitted_at": submittedAt,
+                "rule_submission_duration": duration,
+                "n_dids_in_submission": len(dids),
+                "state": "RULE-SUBMITTED",
+                "is_rule_submission_successful": 1,
+            })
+        return rtn
+
+    def _parseRuleTrackingKwargs(self, kwargs):
+        """ Assign rule tracking variables from kwargs. """
+        self.trackRules = kwargs.get("track_rules", False)
+        self.ruleTrackingKwargs = {
+            "deadlineS": kwargs.get("rule_tracking_deadline_s", 3600),
+            "initialIntervalS": kwargs.get("rule_tracking_initial_interval_s", 5),
+            "maxIntervalS": kwargs.get("rule_tracking_max_interval_s", 60),
+            "backoffFactor": kwargs.get("rule_tracking_backoff_factor", 2),
+        }
+
+    def _beginRuleTracking(self):
+        """ Set up a rule tracker, if requested, so that submitted rules are tracked. """
+        self.ruleTracker = None
+        if self.trackRules:
+            self.ruleTracker = RuleTracker(
+                self.logger,
+                filters={"scope": self.scope, "activity": self.activity},
+                **self.ruleTrackingKwargs
+            )
+
+    def _endRuleTracking(self):
+        """ Wait for tracked rules to finish and add their outcomes, and per RSE pair summaries, to the entries. """
+        if self.ruleTracker is None or not self.ruleTracker.rules:
+            return
+        self.ruleTracker.wait()
+        for entry in self.entries:
+            rule = self.ruleTracker.rules.get(entry.get("rule_id"))
+            if rule is None:
+                continue
+            entry["final_state"] = rule["final_state"]
+            entry["state"] = "RULE-{}".format(rule["final_state"])
+            if rule["final_state"] in RuleTracker.FINAL_STATES:
+                entry["time_to_{}".format(rule["final_state"].lower())] = rule["time_to_final_state"]
+        now = datetime.now().isoformat()
+        for summary in self.ruleTracker.summary():
+            self.logger.info("{} -> {}: {}/{} rules OK, time to OK p50 {}s, p90 {}s".format(
+                summary["from_rse"], summary["to_rse"], summary["n_ok"], summary["n_rules"],
+                summary["time_to_ok_p50"], summary["time_to_ok_p90"]))
+            self.entries.append({
+                "task_name": self.taskName,
+                "type": "rule_summary",
+                "created_at": now,
+                **summary
+            })
+
+    def _uploadAndReplicate(self, datasetDID):
+        """ Upload, attach and add replication rules file by file. """
         for rseSrc in self.rses:
             self.logger.info(
                 bcolors.OKBLUE + "RSE (src): {}".format(rseSrc) + bcolors.ENDC
@@ -64,52 +231,17 @@ class TestUploadReplication(Task):
             for size in self.sizes:
                 self.logger.debug("File size: {} bytes".format(size))
                 for idx in range(self.nFiles):
-                    # Generate random file of size <size>
-                    f = generateRandomFile(size, prefix=self.namingPrefix)
-                    didName = "{}.{}/{}".format(self.ebId, self.productId, os.path.basename(f.name))
-                    fileDID = "{}:{}".format(self.scope, didName)
-
                     # Upload to <rseSrc>
                     self.logger.debug("Uploading file {} of {}".format(idx + 1, self.nFiles))
-
-                    try:
-                        items = [{
-                            "path": f.name,
-                            "rse": rseSrc,
-                            "did_scope": self.scope,
-                            "did_name": didName,
-                            "lifetime": self.lifetime,
-                            "register_after_upload": True,
-                            "force_scheme": None,
-                            "transfer_timeout": 60,
-                        }]
-                        client = UploadClient(logger=self.logger)
-                        client.upload(items=items)
-                    except Exception as e:
-                        self.logger.warning(repr(e))
-                        os.remove(f.name)
+                    did, entry = self._upload(rseSrc, size)
+                    if did is None:
                         break
-                    self.logger.debug("Upload complete")
-                    os.remove(f.name)
 
                     # Attach to dataset
                     self.logger.debug(
-                        "Attaching file {} to {}".format(fileDID, datasetDID)
+                        "Attaching file {}:{} to {}".format(did["scope"], did["name"], datasetDID)
                     )
-                    try:
-                        client = Client(logger=self.logger)
-                        tokens = datasetDID.split(":")
-                        toScope = tokens[0]
-                        toName = tokens[1]
-                        attachment = {"scope": toScope, "name": toName, "dids": []}
-                        for did in fileDID.split(" "):
-                            tokens = did.split(":")
-                            scope = tokens[0]
-                            name = tokens[1]
-                            attachment["dids"].append({"scope": scope, "name": name})
-                        client.attach_dids_to_dids(attachments=[attachment])
-                    except Exception as e:
-                        self.logger.warning(repr(e))
+                    if not self._attach(datasetDID, [did], [entry], Client(logger=self.logger)):
                         break
                     self.logger.debug("Attached file to dataset")
 
@@ -118,62 +250,118 @@ class TestUploadReplication(Task):
                     for rseDst in self.rses:
                         if rseSrc == rseDst:
                             continue
-                        self.logger.debug(
-                            bcolors.OKGREEN
-                            + "RSE (dst): {}".format(rseDst)
-                            + bcolors.ENDC
-                        )
+                        self._addReplicationRules([did], rseSrc, rseDst)
+                    self.logger.debug("Replication rules added")
+
+    def _uploadAndReplicateBatched(self, datasetDID):
+        """
+        Upload all files for each source RSE, then attach them to the dataset in a single attachment and add
+        replication rules for all of them with a single request per destination RSE.
+        """
+        client = Client(logger=self.logger)
+        for rseSrc in self.rses:
+            self.logger.info(
+                bcolors.OKBLUE + "RSE (src): {}".format(rseSrc) + bcolors.ENDC
+            )
+            fileDIDs = []
+            fileEntries = []
+            for size in self.sizes:
+                self.logger.debug("File size: {} bytes".format(size))
+                for idx in range(self.nFiles):
+                    # Upload to <rseSrc>
+                    self.logger.debug("Uploading file {} of {}".format(idx + 1, self.nFiles))
+                    did, entry = self._upload(rseSrc, size)
+                    if did is None:
+                        break
+                    fileDIDs.append(did)
+                    fileEntries.append(entry)
+            if not fileDIDs:
+                continue
+
+            # Attach to dataset
+            self.logger.debug(
+                "Attaching {} files to {}".format(len(fileDIDs), datasetDID)
+            )
+            if not self._attach(datasetDID, fileDIDs, fileEntries, client):
+                continue
+            self.logger.debug("Attached files to dataset")
+
+            # Add replication rules for other RSEs, one request per destination covering all files.
+            self.logger.debug("Adding replication rules...")
+            rsesDst = [rseDst for rseDst in self.rses if rseDst != rseSrc]
+            if self.ruleSubmissionThreads > 1:
+                # The Rucio client's session is not thread-safe, so <client> is not passed and each submission
+                # builds its own.
+                with ThreadPoolExecutor(max_workers=self.ruleSubmissionThreads) as executor:
+                    futures = [(rseDst, executor.submit(self._addReplicationRules, fileDIDs, rseSrc, rseDst))
+                               for rseDst in rsesDst]
+                    for rseDst, future in futures:
                         try:
-                            tokens = fileDID.split(":")
-                            scope = tokens[0]
-                            name = tokens[1]
-
-                            client = Client(logger=self.logger)
-                            rtn = client.add_replication_rule(
-                                dids=[{"scope": scope, "name": name}],
-                                copies=1,
-                                rse_expression=rseDst,
-                                lifetime=self.lifetime,
-                                activity=self.activity,
-                                source_replica_expression=rseSrc,
-                                asynchronous=False,
-                            )
-                            self.logger.debug("Rule ID: {}".format(rtn[0]))
+                            future.result()
                         except Exception as e:
-                            self.logger.warning(repr(e))
-                            continue
-                    self.logger.debug("Replication rules added")
+                            self.logger.warning("Rule submission to {} failed: {}".format(rseDst, repr(e)))
+                            self._addFailedRuleEntries(fileDIDs, rseSrc, rseDst, datetime.now().isoformat(), e)
+            else:
+                for rseDst in rsesDst:
+                    self._addReplicationRules(fileDIDs, rseSrc, rseDst, client=client)
+            self.logger.debug("Replication rules added")
+
+    def run(self, args, kwargs):
+        super().run()
+        self.tic()
+        try:
+            self.activity = kwargs["activity"]
+            self.nFiles = kwargs["n_files"]
+            self.rses = kwargs["rses"]
+            self.scope = kwargs["scope"]
+            self.lifetime = kwargs["lifetime"]
+            self.sizes = kwargs["sizes"]
+            self.outputDatabases = kwargs["output"]["databases"]
+            self.taskName = kwargs["task_name"]
+            self.namingPrefix = kwargs.get("naming_prefix", "")
+            self.ebId = kwargs.get("eb_id", "test_eb_001")
+            self.productId = kwargs.get("product_id", "test_prod_001")
+            self.batched = kwargs.get("batched", False)
+            self.ruleSubmissionThreads = kwargs.get("rule_submission_threads", 1)
+            self._parseRuleTrackingKwargs(kwargs)
+        except KeyError as e:
+            self.logger.critical("Could not find necessary kwarg for task.")
+            self.logger.critical(repr(e))
+            return False
+
+        # Create a dataset to house the data, named with today's date
+        # and scope <scope>.
+        #
+        datasetDID = createCollection(self.logger.name, self.scope)
+
+        # Upload files of size from <sizes> to each RSE, attach to the
+        # dataset, add replication rules to the other listed RSEs.
+        #
+        self.entries = []
+        self._beginRuleTracking()
+        if self.batched:
+            self._uploadAndReplicateBatched(datasetDID)
+        else:
+            self._uploadAndReplicate(datasetDID)
+        self._endRuleTracking()
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Nothing to pass to database, skipping...")
+        pushToDatabases(self.logger.name, self.outputDatabases, self.entries)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
 
 
-class TestUploadReplicationRandom(Task):
+class TestUploadReplicationRandom(TestUploadReplication):
     """ Rucio file upload/replication to random RSEs. """
 
     def __init__(self, logger):
         super().__init__(logger)
-        self.activity = None
-        self.nFiles = None
-        self.rses = None
-        self.scope = None
-        self.lifetime = None
-        self.sizes = None
-        self.outputDatabases = None
-        self.taskName = None
-        self.namingPrefix = None
-        self.ebId = None
-        self.productId = None
+        self.size = None
 
     def run(self, args, kwargs):
-        super().run()
+        Task.run(self)
         self.tic()
         try:
             self.activity = kwargs["activity"]
@@ -187,6 +375,7 @@ class TestUploadReplicationRandom(Task):
             self.namingPrefix = kwargs.get("naming_prefix", "")
             self.ebId = kwargs.get("eb_id", "test_eb_001")
             self.productId = kwargs.get("product_id", "test_prod_001")
+            self._parseRuleTrackingKwargs(kwargs)
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for task.")
             self.logger.critical(repr(e))
@@ -200,6 +389,8 @@ class TestUploadReplicationRandom(Task):
         # Upload a file of size from <sizes> to a random RSE, attach to
         # the dataset and add replication rules to another random RSE.
         #
+        self.entries = []
+        self._beginRuleTracking()
         for idx in range(self.nFiles):
             rseList = copy.deepcopy(self.rses)
             rseSrc = rseList.pop(random.randrange(len(rseList)))
@@ -211,88 +402,29 @@ class TestUploadReplicationRandom(Task):
             )
             self.logger.debug("File size: {} bytes".format(size))
 
-            # Generate random file of size <size>
-            f = generateRandomFile(size, prefix=self.namingPrefix)
-            didName = "{}.{}/{}".format(self.ebId, self.productId, os.path.basename(f.name))
-            fileDID = "{}:{}".format(self.scope, didName)
-
             # Upload to <rseSrc>
             self.logger.debug("Uploading file {} of {}".format(idx + 1, self.nFiles))
-            try:
-                items = [{
-                    "path": f.name,
-                    "rse": rseSrc,
-                    "did_scope": self.scope,
-                    "did_name": didName,
-                    "lifetime": self.lifetime,
-                    "register_after_upload": True,
-                    "force_scheme": None,
-                    "transfer_timeout": 60,
-                }]
-                client = UploadClient(logger=self.logger)
-                client.upload(items=items)
-            except Exception as e:
-                self.logger.warning(repr(e))
-                os.remove(f.name)
+            did, entry = self._upload(rseSrc, size)
+            if did is None:
                 continue
-            self.logger.debug("Upload complete")
-            os.remove(f.name)
 
             # Attach to dataset
             self.logger.debug(
-                "Attaching file {} to {}".format(fileDID, datasetDID)
+                "Attaching file {}:{} to {}".format(did["scope"], did["name"], datasetDID)
             )
-            try:
-                client = Client(logger=self.logger)
-                tokens = datasetDID.split(":")
-                toScope = tokens[0]
-                toName = tokens[1]
-                attachment = {"scope": toScope, "name": toName, "dids": []}
-                for did in fileDID.split(" "):
-                    tokens = did.split(":")
-                    scope = tokens[0]
-                    name = tokens[1]
-                    attachment["dids"].append({"scope": scope, "name": name})
-                client.attach_dids_to_dids(attachments=[attachment])
-            except Exception as e:
-                self.logger.warning(repr(e))
+            if not self._attach(datasetDID, [did], [entry], Client(logger=self.logger)):
                 continue
             self.logger.debug("Attached file to dataset")
 
             # Add replication rules for other RSEs
             self.logger.debug("Adding replication rule...")
-            self.logger.debug(
-                bcolors.OKGREEN
-                + "RSE (dst): {}".format(rseDst)
-                + bcolors.ENDC
-            )
-            try:
-                tokens = fileDID.split(":")
-                scope = tokens[0]
-                name = tokens[1]
-
-                client = Client(logger=self.logger)
-                rtn = client.add_replication_rule(
-                    dids=[{"scope": scope, "name": name}],
-                    copies=1,
-                    rse_expression=rseDst,
-                    lifetime=self.lifetime,
-                    activity=self.activity,
-                    source_replica_expression=rseSrc,
-                    asynchronous=False,
-                )
-                self.logger.debug("Rule ID: {}".format(rtn[0]))
-            except Exception as e:
-                self.logger.warning(repr(e))
-                continue
+            self._addReplicationRules([did], rseSrc, rseDst)
             self.logger.debug("Replication rules added")
+        self._endRuleTracking()
 
         # Push task output to databases.
         #
-        if self.outputDatabases is not None:
-            for database in self.outputDatabases:
-                if database["type"] == "es":
-                    self.logger.info("Nothing to pass to database, skipping...")
+        pushToDatabases(self.logger.name, self.outputDatabases, self.entries)
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
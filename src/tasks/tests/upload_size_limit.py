@@ -2,14 +2,12 @@ import base64
 import os
 import random
 import string
-import time
 from datetime import datetime
 
-import numpy as np
-from astropy.io import fits
 from rucio.client.didclient import DIDClient
 from rucio.client.uploadclient import UploadClient
 
+from common.fits import generateRandomFITSFile
 from tasks.task import Task
 
 FILENAME_LENGTH = 10
@@ -26,20 +24,110 @@ class UploadSizeLimit(Task):
         self.min_size = None
         self.max_size = None
         self.factor = None
+        self.mode = None
+        self.tolerance = None
+        self._attempts = {}     # array size -> (filename, filesize, is_upload_successful)
 
     def _create_file(self, size):
         """ Create a temporary fits file with float64 array data """
         random_string = ''.join(random.choices(string.ascii_lowercase, k=FILENAME_LENGTH))
         filename = f'{random_string}.fits'
         self.logger.info(f'Creating file {filename} with array length {size}')
-        data = np.random.rand(size)
-        hdu = fits.ImageHDU()
-        hdu.data = data
-        hdu.writeto(filename)
+        try:
+            with self.span("create_file") as span:
+                generateRandomFITSFile(filename, (size,))
+        except Exception:
+            if os.path.exists(filename):
+                os.remove(filename)
+            raise
         filesize = os.path.getsize(filename) / 1e6
         self.logger.info(f'Filesize {filesize} MB')
+        self.logger.info("Create file duration: {}".format(span.duration))
         return filename, filesize
 
+    def _upload(self, size):
+        """
+        Create and upload a file with array length <size>, returning True if the upload succeeded.
+
+        Errors creating the local file are raised rather than counted as failed uploads, as they say nothing about
+        the upload size limit.
+
+        Attempts are cached by size for the duration of the run so that no size is generated or uploaded twice.
+        """
+        if size in self._attempts:
+            return self._attempts[size][2]
+
+        filename, filesize = self._create_file(size)
+        try:
+            self.logger.info(f'Uploading {filename} to rucio as did {self.scope}:{filename}')
+
+            items = [{
+                "path": filename,
+                "rse": self.rse,
+                "did_scope": self.scope,
+                "lifetime": self.lifetime,
+                "register_after_upload": True,
+                "force_scheme": None,
+                "transfer_timeout": 60,
+            }]
+            with self.span("upload", rse=self.rse) as span:
+                client = UploadClient(logger=self.logger)
+                client.upload(items=items)
+            self.logger.info("Rucio upload duration: {}".format(span.duration))
+            success = True
+        except Exception as e:
+            self.logger.warning(repr(e))
+            self.logger.info(f'Upload failed for file size {filesize} MB')
+            success = False
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+        self._attempts[size] = (filename, filesize, success)
+        return success
+
+    def _sweep(self):
+        """ Increase the array size by <factor> until the first failed upload. """
+        array_size = self.min_size
+        while (array_size <= self.max_size):
+            if not self._upload(array_size):
+                return
+            array_size = array_size * self.factor
+            self.logger.info(f'Array size increased to {array_size}')
+
+    def _bisect(self):
+        """
+        Bracket the limit by increasing the array size by <factor> until the first failed upload, then bisect between
+        the last successful and first failed array sizes until they are within <tolerance> of each other.
+        """
+        last_success, first_failure = None, None
+        array_size = self.min_size
+        while (array_size <= self.max_size):
+            if not self._upload(array_size):
+                first_failure = array_size
+                break
+            last_success = array_size
+            array_size = array_size * self.factor
+            self.logger.info(f'Array size increased to {array_size}')
+
+        if first_failure is None:
+            self.logger.info(f'No upload failures up to array length {last_success}')
+            return
+        if last_success is None:
+            self.logger.info(f'Upload failed for the minimum array length {first_failure}')
+            return
+
+        self.logger.info(f'Limit bracketed between array lengths {last_success} and {first_failure}, bisecting...')
+        while first_failure - last_success > self.tolerance:
+            array_size = (last_success + first_failure) // 2
+            if self._upload(array_size):
+                last_success = array_size
+            else:
+                first_failure = array_size
+
+        self.logger.info("Upload size limit found between array lengths {} ({} MB) and {} ({} MB)".format(
+            last_success, self._attempts[last_success][1], first_failure, self._attempts[first_failure][1]))
+
     def run(self, args, kwargs):
         super().run()
         self.tic()
@@ -50,6 +138,8 @@ class UploadSizeLimit(Task):
             self.min_size = kwargs['min_size']
             self.max_size = kwargs['max_size']
             self.factor = kwargs['factor']
+            self.mode = kwargs.get('mode', 'sweep')
+            self.tolerance = max(1, kwargs.get('tolerance', self.min_size))
 
         except KeyError as e:
             self.logger.critical("Could not find necessary kwarg for test.")
@@ -57,38 +147,21 @@ class UploadSizeLimit(Task):
             return False
 
         self.logger.info("Starting tests for rucio upload file size limit")
-        array_size = self.min_size
-
-        while (array_size <= self.max_size):
-            try:
-                start = time.time()
-                filename, filesize = self._create_file(array_size)
-                self.logger.info(f'Uploading {filename} to rucio as did {self.scope}:{filename}')
-
-                items = [{
-                    "path": filename,
-                    "rse": self.rse,
-                    "did_scope": self.scope,
-                    "lifetime": self.lifetime,
-                    "register_after_upload": True,
-                    "force_scheme": None,
-                    "transfer_timeout": 60,
-                }]
-                client = UploadClient(logger=self.logger)
-                client.upload(items=items)
-                self.logger.info("Rucio upload duration: {}".format(time.time() - start))
-
-                # Iterate
-                if os.path.exists(filename):
-                    os.remove(filename)
-                array_size = array_size * self.factor
-                self.logger.info(f'Array size increased to {array_size}')
-            except Exception as e:
-                self.logger.warning(repr(e))
-                self.logger.info(f'Upload failed for file size {filesize} MB')
-                if os.path.exists(filename):
-                    os.remove(filename)
-                return
+        self._attempts = {}
+        if self.mode not in ('sweep', 'bisect'):
+            self.logger.critical("Unknown mode {}, expected one of sweep || bisect".format(self.mode))
+            return False
+        try:
+            if self.mode == 'sweep':
+                self._sweep()
+            else:
+                self._bisect()
+        except Exception as e:
+            # Only errors creating local files escape _upload.
+            self.logger.critical("Could not create file to upload, aborting.")
+            self.logger.critical(repr(e))
+            return False
+        self.logger.info("Made {} upload attempts".format(len(self._attempts)))
 
         self.toc()
         self.logger.info("Finished in {}s".format(round(self.elapsed)))
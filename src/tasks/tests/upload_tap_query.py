@@ -1,13 +1,12 @@
 from datetime import datetime
 import os
-import time
 
 from rucio.client.uploadclient import UploadClient
 from rucio.client.didclient import DIDClient
 
-from astropy.io import fits
-import numpy as np
 from astroquery.utils.tap.core import TapPlus
+
+from common.fits import generateRandomFITSFile
 from tasks.task import Task
 
 
@@ -60,20 +59,14 @@ class UploadTAPQuery(Task):
         self.logger.info(f"Creating mock fits file {self.filename} [{self.nx}, {self.ny}, {self.nz}]")
         if os.path.exists(self.filename):
             os.remove(self.filename)
-        start = time.time()
-        data = np.random.rand(self.nx, self.ny, self.nz)
-        hdu = fits.ImageHDU()
-        hdu.data = data
-        for k, v in self.fits_header.items():
-            hdu.header[k] = v
-        hdu.writeto(self.filename)
-        self.logger.info("Create mock fits file duration: {}".format(time.time() - start))
+        with self.span("create_file") as span:
+            generateRandomFITSFile(self.filename, (self.nx, self.ny, self.nz), header=self.fits_header)
+        self.logger.info("Create mock fits file duration: {}".format(span.duration))
 
         # Rucio upload
         self.logger.info("Uploading to {}".format(self.rse))
         self.logger.info(f"Rucio did: {self.did}")
         try:
-            start = time.time()
             items = [{
                 "path": self.filename,
                 "rse": self.rse,
@@ -83,9 +76,10 @@ class UploadTAPQuery(Task):
                 "force_scheme": None,
                 "transfer_timeout": 60,
             }]
-            client = UploadClient(logger=self.logger)
-            client.upload(items=items)
-            self.logger.info("Rucio upload duration: {}".format(time.time() - start))
+            with self.span("upload", rse=self.rse) as span:
+                client = UploadClient(logger=self.logger)
+                client.upload(items=items)
+            self.logger.info("Rucio upload duration: {}".format(span.duration))
             self.logger.debug("Upload complete")
         except Exception as e:
             self.logger.warning(repr(e))
@@ -94,20 +88,20 @@ class UploadTAPQuery(Task):
         # Add metadata
         self.logger.info(f"Adding metadata to rucio did {self.did}")
         try:
-            start = time.time()
             self.rucio_metadata['rucio_did_name'] = self.filename
             self.rucio_metadata['rucio_did_scope'] = self.scope
             self.rucio_metadata['obs_publisher_did'] = f'{self.did}'
             self.rucio_metadata['obs_id'] = f'{self.did}'
 
-            client = DIDClient(logger=self.logger)
-            client.set_metadata_bulk(
-                scope=self.scope,
-                name=self.filename,
-                meta=self.rucio_metadata
-            )
+            with self.span("set_metadata") as span:
+                client = DIDClient(logger=self.logger)
+                client.set_metadata_bulk(
+                    scope=self.scope,
+                    name=self.filename,
+                    meta=self.rucio_metadata
+                )
             self.logger.info(f'Added metadata to did {self.did}')
-            self.logger.info("Add metadata upload duration: {}".format(time.time() - start))
+            self.logger.info("Add metadata upload duration: {}".format(span.duration))
         except Exception as e:
             self.logger.warning(repr(e))
             return
@@ -116,10 +110,10 @@ class UploadTAPQuery(Task):
         try:
             self.tap_query = self.tap_query.replace('$OBS_COLLECTION', self.rucio_metadata['obs_collection'])
             self.logger.info(f'TAP query: {self.tap_query}')
-            start = time.time()
-            tap = TapPlus(url=self.tap_url, verbose=False)
-            job = tap.launch_job(self.tap_query)
-            results = job.get_results()
+            with self.span("tap_query") as span:
+                tap = TapPlus(url=self.tap_url, verbose=False)
+                job = tap.launch_job(self.tap_query)
+                results = job.get_results()
             self.logger.info(f'Query results: {results}')
         except Exception as e:
             self.logger.critical("Error encountered when issuing TAP query: {}".format(e))
@@ -129,7 +123,7 @@ class UploadTAPQuery(Task):
 
         # Verify file exists
         assert self.did in results['obs_id'], f'Did not find file with DID {self.did} in TAP query.'
-        self.logger.info("TAP query check duration: {}".format(time.time() - start))
+        self.logger.info("TAP query check duration: {}".format(span.duration))
 
         # Cleanup
         self.logger.info("Running cleanup")
@@ -19,10 +19,13 @@ class bcolors:
     UNDERLINE = "\033[4m"
 
 
-def generateRandomFile(size, prefix="", suffix="", dirname=""):
+def generateRandomFile(size, prefix="", suffix="", dirname="", payload=None):
     """
     Generate a randomly named file of size, <size>, with random contents.
 
+    If <payload> is given it is written instead of generating new random contents, so that many files can share
+    a single buffer.
+
     Returns a handle to the file.
     """
     if prefix:  # add file prefix if set.
@@ -37,7 +40,7 @@ def generateRandomFile(size, prefix="", suffix="", dirname=""):
         os.makedirs(dirname, exist_ok=True)
     absFilename = os.path.join(dirname, basename)
     with open(absFilename, "wb") as f:
-        f.write(os.urandom(size))
+        f.write(payload if payload is not None else os.urandom(size))
     return f
 
 
@@ -130,3 +133,25 @@ def getObsCoreMetadataDict(
     else:
         return obscore_dict
 
+
+
+def calculatePercentiles(values, percentiles=(50, 90, 99)):
+    """
+    Calculate the percentiles, <percentiles>, of a list of numeric values, interpolating linearly between
+    closest ranks.
+
+    Returns a dictionary keyed by "p<percentile>" and "max", with None values if <values> is empty.
+    """
+    ordered = sorted(values)
+    result = {}
+    for percentile in percentiles:
+        key = "p{}".format(percentile)
+        if not ordered:
+            result[key] = None
+            continue
+        rank = (len(ordered) - 1) * percentile / 100.
+        lower = int(rank)
+        upper = min(lower + 1, len(ordered) - 1)
+        result[key] = ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+    result["max"] = ordered[-1] if ordered else None
+    return result